@@ -0,0 +1,651 @@
+from array import array
+from collections.abc import Mapping
+import hashlib
+import json
+import math
+import mmap
+from multiprocessing import shared_memory
+import os
+import struct
+
+import numpy as np
+
+# Binary snapshot layout: magic, format version, header length, JSON header,
+# then the arrays listed in the header, each aligned to ALIGN bytes.
+MAGIC = b"RTGRAPH\0"
+FORMAT_VERSION = 5
+ALIGN = 64
+
+# Meters per degree of latitude, as in OSMHandler.distance
+METERS_PER_DEGREE = 60 * 1.1515 * 1.609344 * 1000
+
+def distanceArray(lat1,lon1,lat2,lon2) :
+    """Vectorized OSMHandler.distance for coordinate arrays (or scalars broadcast against them)"""
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dist = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(np.radians(np.subtract(lon1,lon2)))
+    dist = np.degrees(np.arccos(np.minimum(dist,1)))
+    dist = dist * 60 * 1.1515
+    dist = dist * 1.609344 * 1000
+    return dist
+
+def signatureTriples(sig1,sig2,wsig,sigCount) :
+    """(triples,tripleIndex) for edges given by node and way signature arrays
+
+    triples holds the distinct (node,node,way) signature triples as rows of an
+    (n,3) array, tripleIndex the row of every edge. Penalties only depend on
+    these triples, so they are computed once per graph, not per rule set.
+    """
+    sig1 = np.asarray(sig1).astype(np.int64)
+    sig2 = np.asarray(sig2).astype(np.int64)
+    wsig = np.asarray(wsig).astype(np.int64)
+
+    # Two steps so the combined key cannot overflow int64
+    (pairs,pairIndex) = np.unique(sig1 * sigCount + sig2,return_inverse=True)
+    (triples,tripleIndex) = np.unique(pairIndex.astype(np.int64) * sigCount + wsig,return_inverse=True)
+    pair = pairs[triples // sigCount]
+    triples = np.stack([ pair // sigCount, pair % sigCount, triples % sigCount ],axis=1)
+    return (triples,tripleIndex.astype(np.int32 if len(triples) < 2**31 else np.int64))
+
+def gridIndex(lat,lon,nodes) :
+    """Uniform grid over the given node indices for nearest node lookups
+
+    Coordinates are projected to meters around the middle latitude and the
+    cell size is chosen for about one node per cell. Returns (gridMeta,
+    gridOffsets,gridNodes): gridMeta holds the origin, meters per degree of
+    longitude, cell size and grid shape, the nodes of cell row*cols+col are
+    gridNodes[gridOffsets[cell]:gridOffsets[cell+1]].
+    """
+    if len(nodes) == 0 :
+        return (np.zeros(6),np.zeros(1,dtype=np.int64),np.zeros(0,dtype=np.int32))
+
+    lat0 = float(lat[nodes].min())
+    lon0 = float(lon[nodes].min())
+    kx = METERS_PER_DEGREE * np.cos(np.radians(( lat0 + float(lat[nodes].max()) ) / 2))
+    x = ( lon[nodes] - lon0 ) * kx
+    y = ( lat[nodes] - lat0 ) * METERS_PER_DEGREE
+
+    cellSize = max(np.sqrt(( x.max() + 1 ) * ( y.max() + 1 ) / len(nodes)),10.0)
+    rows = int(y.max() // cellSize) + 1
+    cols = int(x.max() // cellSize) + 1
+    cell = ( y // cellSize ).astype(np.int64) * cols + ( x // cellSize ).astype(np.int64)
+
+    order = np.argsort(cell,kind="stable")
+    gridOffsets = np.searchsorted(cell[order],np.arange(rows*cols+1)).astype(np.int64)
+    return (np.array([ lat0, lon0, kx, cellSize, rows, cols ]),gridOffsets,nodes[order].astype(np.int32))
+
+def sourceFingerprint(filename,previous=None) :
+    """Size, mtime and content hash of a source file for cache invalidation
+
+    previous is an earlier fingerprint of the file, e.g. as stored in a
+    snapshot. If size and mtime did not change since, its hash is taken over
+    and the file is not read at all.
+    """
+    stat = os.stat(filename)
+    fingerprint = { "size" : stat.st_size, "mtime" : stat.st_mtime_ns }
+    if previous is not None and "hash" in previous and previous.get("size") == fingerprint["size"] and previous.get("mtime") == fingerprint["mtime"] :
+        fingerprint["hash"] = previous["hash"]
+        return fingerprint
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename,"rb") as f :
+        for chunk in iter(lambda : f.read(1 << 20),b"") :
+            digest.update(chunk)
+    fingerprint["hash"] = digest.hexdigest()
+    return fingerprint
+
+def writeSnapshot(filename,arrays,meta) :
+    """Write arrays and a JSON-serializable meta dict, atomically replacing filename"""
+    arrays = { name : np.ascontiguousarray(a) for name,a in arrays.items() }
+    layout = dict()
+    offset = 0
+    for name,a in arrays.items() :
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        layout[name] = (a.dtype.str,list(a.shape),offset)
+        offset += a.nbytes
+    header = json.dumps(dict(meta,version=FORMAT_VERSION,arrays=layout)).encode("utf-8")
+    start = (len(MAGIC) + 8 + len(header) + ALIGN - 1) // ALIGN * ALIGN
+
+    tmpname = filename + ".tmp"
+    with open(tmpname,"wb") as f :
+        f.write(MAGIC)
+        f.write(struct.pack("<II",FORMAT_VERSION,len(header)))
+        f.write(header)
+        for name,a in arrays.items() :
+            f.seek(start + layout[name][2])
+            f.write(a.tobytes())
+    os.replace(tmpname,filename)
+
+def readHeader(f) :
+    """(JSON header,its length) of the snapshot open as f, None if it is no snapshot, outdated or damaged"""
+    if f.read(len(MAGIC)) != MAGIC :
+        return None
+    fields = f.read(8)
+    if len(fields) != 8 :
+        return None
+    (version,length) = struct.unpack("<II",fields)
+    if version != FORMAT_VERSION :
+        return None
+    data = f.read(length)
+    if len(data) != length :
+        return None
+    try :
+        header = json.loads(data.decode("utf-8"))
+    except ValueError :
+        return None
+    if not isinstance(header,dict) :
+        return None
+    return (header,length)
+
+def snapshotSource(filename) :
+    """Source fingerprint stored in a snapshot without mapping its arrays, None if there is none"""
+    if not os.path.exists(filename) :
+        return None
+    with open(filename,"rb") as f :
+        result = readHeader(f)
+    return result[0].get("source") if result is not None else None
+
+def updateSnapshotSource(filename,previous,source) :
+    """Store source instead of previous in the header of a snapshot, in place
+
+    For a source whose mtime changed but not its content, so it is not hashed
+    again on the next load. False if the snapshot is missing, was not made from
+    previous or the new header does not fit into the old one.
+    """
+    if not os.path.exists(filename) :
+        return False
+    with open(filename,"r+b") as f :
+        result = readHeader(f)
+        if result is None or result[0].get("source") != previous :
+            return False
+        (header,length) = result
+        data = json.dumps(dict(header,source=source)).encode("utf-8")
+        if len(data) > length :
+            return False
+        # Padded with blanks, so the length and the array offsets stay as they are
+        f.seek(len(MAGIC) + 8)
+        f.write(data.ljust(length))
+    return True
+
+def readSnapshot(filename) :
+    """Meta dict and read-only memory-mapped arrays of a snapshot, None if missing, outdated or damaged
+
+    A damaged (e.g. truncated) file counts as missing, so it is rebuilt and replaced.
+    """
+    if not os.path.exists(filename) :
+        return None
+    with open(filename,"rb") as f :
+        result = readHeader(f)
+        if result is None :
+            return None
+        (header,length) = result
+        try :
+            buffer = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except ValueError :
+            return None
+    start = (len(MAGIC) + 8 + length + ALIGN - 1) // ALIGN * ALIGN
+    arrays = dict()
+    try :
+        for name,(dtype,shape,offset) in header["arrays"].items() :
+            count = int(np.prod(shape))
+            if count == 0 :
+                arrays[name] = np.empty(shape,dtype=dtype)
+            else :
+                arrays[name] = np.frombuffer(buffer,dtype=dtype,count=count,offset=start+offset).reshape(shape)
+    except (KeyError,TypeError,ValueError) :
+        return None
+    return (header,arrays)
+
+def shareArrays(arrays) :
+    """Copy arrays once into a new shared memory block, returns the block and a picklable layout"""
+    layout = dict()
+    offset = 0
+    for name,a in arrays.items() :
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        layout[name] = (a.dtype.str,list(a.shape),offset)
+        offset += a.nbytes
+    block = shared_memory.SharedMemory(create=True,size=max(offset,1))
+    for name,a in arrays.items() :
+        (dtype,shape,offset) = layout[name]
+        np.ndarray(shape,dtype=dtype,buffer=block.buf,offset=offset)[...] = a
+    return (block,layout)
+
+def attachArrays(name,layout) :
+    """Read-only arrays on a shared memory block made by shareArrays(), without copying"""
+    try :
+        block = shared_memory.SharedMemory(name=name,track=False)
+    except TypeError :
+        # Before Python 3.13 attaching cannot opt out of the resource tracker
+        block = shared_memory.SharedMemory(name=name)
+    arrays = dict()
+    for name,(dtype,shape,offset) in layout.items() :
+        a = np.ndarray(shape,dtype=dtype,buffer=block.buf,offset=offset)
+        a.flags.writeable = False
+        arrays[name] = a
+    return (block,arrays)
+
+class TagSignature:
+    """Shared tag holder for all nodes or ways with the same interned tags"""
+    def __init__(self,tags) :
+        self.tags = tags
+
+class CompactGraphBuilder:
+    """Collects nodes and highway ways while parsing, without one object per node"""
+    def __init__(self) :
+        self.nodeIds = array("q")
+        self.nodeLat = array("d")
+        self.nodeLon = array("d")
+        self.nodeSig = array("i")
+
+        self.wayIds     = array("q")
+        self.waySig     = array("i")
+        self.wayOffsets = array("q",[0])
+        self.wayRefs    = array("q")
+
+        self.tagIndex = dict()
+        self.tagList  = []
+        self.sigIndex = { () : 0 }
+        self.sigList  = [ () ]
+
+    def intern(self,tags) :
+        if len(tags) == 0 :
+            return 0
+        sig = []
+        for key,value in tags :
+            tid = self.tagIndex.get((key,value))
+            if tid is None :
+                tid = len(self.tagList)
+                self.tagIndex[(key,value)] = tid
+                self.tagList.append((key,value))
+            sig.append(tid)
+        sig = tuple(sig)
+        sid = self.sigIndex.get(sig)
+        if sid is None :
+            sid = len(self.sigList)
+            self.sigIndex[sig] = sid
+            self.sigList.append(sig)
+        return sid
+
+    def addNode(self,id,lat,lon,tags) :
+        self.nodeIds.append(id)
+        self.nodeLat.append(lat)
+        self.nodeLon.append(lon)
+        self.nodeSig.append(self.intern(tags))
+
+    def addWay(self,id,refs,tags) :
+        self.wayIds.append(id)
+        self.waySig.append(self.intern(tags))
+        self.wayRefs.extend(refs)
+        self.wayOffsets.append(len(self.wayRefs))
+
+    def build(self) :
+        nodeIds = np.frombuffer(self.nodeIds,dtype=np.int64)
+        nodeOrder = np.argsort(nodeIds,kind="stable")
+        nodeIds = nodeIds[nodeOrder]
+        lat = np.frombuffer(self.nodeLat,dtype=np.float64)[nodeOrder]
+        lon = np.frombuffer(self.nodeLon,dtype=np.float64)[nodeOrder]
+        nodeSig = np.frombuffer(self.nodeSig,dtype=np.int32)[nodeOrder]
+
+        wayIds = np.frombuffer(self.wayIds,dtype=np.int64)
+        wayOrder = np.argsort(wayIds,kind="stable")
+        wayRank = np.empty_like(wayOrder)
+        wayRank[wayOrder] = np.arange(len(wayOrder))
+        wayOffsets = np.frombuffer(self.wayOffsets,dtype=np.int64)
+        wayRefs = np.frombuffer(self.wayRefs,dtype=np.int64)
+
+        # Resolve node ids to indices; refs to nodes missing in the extract become -1
+        refIdx = np.searchsorted(nodeIds,wayRefs)
+        refIdx[refIdx >= len(nodeIds)] = 0
+        found = len(nodeIds) > 0 and nodeIds[refIdx] == wayRefs
+        refIdx = np.where(found,refIdx,-1)
+
+        # Consecutive refs of the same way form an edge in both directions,
+        # emitted in parse order so adjacency keeps the order of Node.ways
+        refWay = np.repeat(np.arange(len(wayIds)),np.diff(wayOffsets))
+        a = refIdx[:-1]
+        b = refIdx[1:]
+        valid = (refWay[:-1] == refWay[1:]) & (a >= 0) & (b >= 0) & (a != b)
+        a = a[valid]
+        b = b[valid]
+        w = wayRank[refWay[:-1][valid]]
+
+        src = np.stack([a,b],axis=1).ravel()
+        dst = np.stack([b,a],axis=1).ravel()
+        edgeOrder = np.argsort(src,kind="stable")
+
+        offsets = np.zeros(len(nodeIds)+1,dtype=np.int64)
+        np.cumsum(np.bincount(src,minlength=len(nodeIds)),out=offsets[1:])
+
+        # Edges were emitted in pairs, so the reverse of edge k was k^1
+        edgeRank = np.empty_like(edgeOrder)
+        edgeRank[edgeOrder] = np.arange(len(edgeOrder))
+        twin = edgeRank[edgeOrder ^ 1]
+
+        src = src[edgeOrder]
+        dst = dst[edgeOrder]
+
+        wayLengths = np.diff(wayOffsets)[wayOrder]
+        sortedWayOffsets = np.zeros(len(wayIds)+1,dtype=np.int64)
+        np.cumsum(wayLengths,out=sortedWayOffsets[1:])
+        sortedWayRefs = wayRefs[np.repeat(wayOffsets[:-1][wayOrder]-sortedWayOffsets[:-1],wayLengths)+np.arange(len(wayRefs))]
+
+        # Only nodes with edges can be routed from, so only those are snapped to
+        (gridMeta,gridOffsets,gridNodes) = gridIndex(lat,lon,np.flatnonzero(np.diff(offsets) > 0))
+
+        return CompactGraph(nodeIds = nodeIds,
+                            lat = lat,
+                            lon = lon,
+                            nodeSig = nodeSig,
+                            offsets = offsets,
+                            neighbors = dst.astype(np.int32),
+                            edgeWay = np.repeat(w,2)[edgeOrder].astype(np.int32),
+                            length = distanceArray(lat[src],lon[src],lat[dst],lon[dst]),
+                            twin = twin.astype(np.int32),
+                            wayIds = wayIds[wayOrder],
+                            waySig = np.frombuffer(self.waySig,dtype=np.int32)[wayOrder],
+                            wayOffsets = sortedWayOffsets,
+                            wayRefs = sortedWayRefs,
+                            gridMeta = gridMeta,
+                            gridOffsets = gridOffsets,
+                            gridNodes = gridNodes,
+                            tagList = self.tagList,
+                            sigList = self.sigList)
+
+class GraphLookup:
+    """Id lookups and display ways shared by CompactGraph and TiledGraph
+
+    Needs sorted nodeIds/wayIds arrays, wayOffsets/wayRefs, waySig, tagList,
+    sigObjects and a _tagIds cache attribute on the graph.
+    """
+    def tagIds(self) :
+        """Interned tag id for every "tag==value" string as used in rules"""
+        if self._tagIds is None :
+            self._tagIds = { key + "==" + value : t for t,(key,value) in enumerate(self.tagList) }
+        return self._tagIds
+
+    def nodeCount(self) :
+        return len(self.nodeIds)
+
+    def _find(self,ids,id) :
+        i = int(np.searchsorted(ids,id))
+        if i < len(ids) and ids[i] == id :
+            return i
+        return -1
+
+    def index(self,nid) :
+        """Node index for an OSM node id, -1 if not present"""
+        return self._find(self.nodeIds,nid)
+
+    def wayIndex(self,wid) :
+        return self._find(self.wayIds,wid)
+
+    def way(self,w) :
+        """Build a display Way object for way index w"""
+        from OSMHandler import Way
+        return Way(int(self.wayIds[w]),
+                   self.wayRefs[self.wayOffsets[w]:self.wayOffsets[w+1]].tolist(),
+                   dict(self.sigObjects[self.waySig[w]].tags))
+
+class CompactGraph(GraphLookup):
+    """Highway graph as integer-indexed arrays with a CSR adjacency
+
+    Nodes and ways are sorted by OSM id, node index i has its outgoing edges
+    at offsets[i]:offsets[i+1] in neighbors (node index) and edgeWay (way index),
+    length holds the segment length of every edge and twin the index of the
+    same segment in the opposite direction.
+    Tags are interned: nodeSig/waySig index sigList, a tuple of tagList indices.
+    gridMeta/gridOffsets/gridNodes are a spatial grid over the routable nodes,
+    see gridIndex().
+    """
+    arrayNames = ( "nodeIds", "lat", "lon", "nodeSig", "offsets", "neighbors", "edgeWay", "length", "twin",
+                   "wayIds", "waySig", "wayOffsets", "wayRefs", "gridMeta", "gridOffsets", "gridNodes" )
+
+    def __init__(self,nodeIds,lat,lon,nodeSig,offsets,neighbors,edgeWay,length,twin,wayIds,waySig,wayOffsets,wayRefs,
+                 gridMeta,gridOffsets,gridNodes,tagList,sigList) :
+        self.nodeIds    = nodeIds
+        self.lat        = lat
+        self.lon        = lon
+        self.nodeSig    = nodeSig
+        self.offsets    = offsets
+        self.neighbors  = neighbors
+        self.edgeWay    = edgeWay
+        self.length     = length
+        self.twin       = twin
+        self.wayIds     = wayIds
+        self.waySig     = waySig
+        self.wayOffsets = wayOffsets
+        self.wayRefs    = wayRefs
+        self.gridMeta    = gridMeta
+        self.gridOffsets = gridOffsets
+        self.gridNodes   = gridNodes
+        self.tagList    = tagList
+        self.sigList    = sigList
+        self.sigObjects = [ TagSignature({ key : value for (key,value) in (tagList[t] for t in sig) }) for sig in sigList ]
+        self.source     = None
+        self._tagIds = None
+        self._sigStrings = None
+        self._edgeSource = None
+        self._adjacencyLists = None
+        self._grid = None
+        self._trigonometry = None
+        self._edgeTriples = None
+
+    def sigStrings(self) :
+        """"tag==value" strings of every signature"""
+        if self._sigStrings is None :
+            self._sigStrings = [ [ key + "==" + value for (key,value) in ( self.tagList[t] for t in sig ) ] for sig in self.sigList ]
+        return self._sigStrings
+
+    def edgeSource(self) :
+        """Source node index of every edge"""
+        if self._edgeSource is None :
+            self._edgeSource = np.repeat(np.arange(self.nodeCount(),dtype=np.int32),np.diff(self.offsets))
+        return self._edgeSource
+
+    def edgeTriples(self) :
+        """signatureTriples() of all edges, computed on first use"""
+        if self._edgeTriples is None :
+            self._edgeTriples = signatureTriples(self.nodeSig[self.edgeSource()],self.nodeSig[self.neighbors],self.waySig[self.edgeWay],len(self.sigList))
+        return self._edgeTriples
+
+    def adjacencyLists(self) :
+        """offsets and neighbors as plain lists, for the tightest search loops"""
+        if self._adjacencyLists is None :
+            self._adjacencyLists = (self.offsets.tolist(),self.neighbors.tolist())
+        return self._adjacencyLists
+
+    def save(self,filename,source=None) :
+        """Write a binary snapshot, atomically replacing filename"""
+        self.source = source
+        writeSnapshot(filename,
+                      { name : getattr(self,name) for name in self.arrayNames },
+                      { "source" : source, "tags" : self.tagList, "sigs" : self.sigList })
+
+    @classmethod
+    def load(cls,filename,source=None) :
+        """Memory-map a snapshot, None if missing, outdated or made from a different source"""
+        result = readSnapshot(filename)
+        if result is None :
+            return None
+        (header,arrays) = result
+        if source is not None and header["source"] != source :
+            return None
+        graph = cls(tagList = [ tuple(tag) for tag in header["tags"] ],
+                    sigList = [ tuple(sig) for sig in header["sigs"] ],
+                    **arrays)
+        graph.source = header["source"]
+        return graph
+
+    def share(self) :
+        """Publish the graph in shared memory
+
+        Returns the block, which the caller keeps alive and unlinks when done, and a
+        picklable handle for attach() in worker processes.
+        """
+        arrays = { name : getattr(self,name) for name in self.arrayNames }
+        arrays["edgeSource"] = self.edgeSource()
+        (block,layout) = shareArrays(arrays)
+        return (block,{ "name"   : block.name,
+                        "layout" : layout,
+                        "tags"   : self.tagList,
+                        "sigs"   : self.sigList,
+                        "source" : self.source })
+
+    @classmethod
+    def attach(cls,handle) :
+        """Graph on the shared memory published by share(), sharing all arrays read-only"""
+        (block,arrays) = attachArrays(handle["name"],handle["layout"])
+        edgeSource = arrays.pop("edgeSource")
+        graph = cls(tagList = handle["tags"],sigList = handle["sigs"],**arrays)
+        graph.source = handle["source"]
+        graph._edgeSource = edgeSource
+        graph.sharedMemory = block
+        return graph
+
+    def edgeCount(self) :
+        return len(self.neighbors)
+
+    def distanceTo(self,goal) :
+        """Function of a node index giving its great-circle distance to node index goal
+
+        Same as distanceArray() but computed only for the nodes asked for, from
+        the sines and cosines of all latitudes computed once per graph, so a
+        short search does not pay for a pass over all nodes.
+        """
+        if self._trigonometry is None :
+            lat = np.radians(self.lat)
+            self._trigonometry = (memoryview(np.sin(lat)),memoryview(np.cos(lat)),memoryview(self.lon))
+        (sinLat,cosLat,lon) = self._trigonometry
+        (sinGoal,cosGoal,lonGoal) = (sinLat[goal],cosLat[goal],lon[goal])
+        (acos,cos,degrees,radians) = (math.acos,math.cos,math.degrees,math.radians)
+
+        def distance(v) :
+            dist = sinLat[v] * sinGoal + cosLat[v] * cosGoal * cos(radians(lon[v] - lonGoal))
+            return degrees(acos(min(dist,1))) * 60 * 1.1515 * 1.609344 * 1000
+        return distance
+
+    def nearest(self,lat,lon) :
+        """Index of the routable node nearest to lat/lon, -1 if there is none
+
+        Distances are measured in the projection of gridIndex(), which differs
+        from great-circle distances by far less than a meter at city scale.
+        Grid cells are scanned in rings around the cell of lat/lon until no
+        closer node can follow.
+        """
+        if self._grid is None :
+            (lat0,lon0,kx,cellSize,rows,cols) = self.gridMeta.tolist()
+            self._grid = (lat0,lon0,kx,cellSize,int(rows),int(cols),
+                          memoryview(self.gridOffsets),memoryview(self.gridNodes),memoryview(self.lat),memoryview(self.lon))
+        (lat0,lon0,kx,cellSize,rows,cols,offsets,nodes,lats,lons) = self._grid
+        if rows == 0 :
+            return -1
+
+        x = ( lon - lon0 ) * kx
+        y = ( lat - lat0 ) * METERS_PER_DEGREE
+        cx = math.floor(x / cellSize)
+        cy = math.floor(y / cellSize)
+
+        best = -1
+        bestDistance = math.inf
+        # Smaller rings lie completely outside the grid
+        r = max(0,-cx,-cy,cx-cols+1,cy-rows+1)
+        while True :
+            for gy in range(max(cy-r,0),min(cy+r,rows-1)+1) :
+                # Full rows at the top and bottom of the ring, else just both ends
+                if gy == cy-r or gy == cy+r :
+                    columns = range(max(cx-r,0),min(cx+r,cols-1)+1)
+                else :
+                    columns = [ gx for gx in (cx-r,cx+r) if 0 <= gx < cols ]
+                for gx in columns :
+                    cell = gy * cols + gx
+                    for k in range(offsets[cell],offsets[cell+1]) :
+                        i = nodes[k]
+                        dx = ( lons[i] - lon ) * kx
+                        dy = ( lats[i] - lat ) * METERS_PER_DEGREE
+                        distance = dx*dx + dy*dy
+                        if distance < bestDistance :
+                            bestDistance = distance
+                            best = i
+            # Nodes outside the rings so far are at least r cells away
+            if bestDistance <= ( r * cellSize ) ** 2 :
+                return best
+            if cy-r <= 0 and cx-r <= 0 and cy+r >= rows-1 and cx+r >= cols-1 :
+                return best
+            r += 1
+
+    def inRadius(self,lat,lon,radius) :
+        """Indices of routable nodes within radius meters (great-circle) of lat/lon, nearest first"""
+        (lat0,lon0,kx,cellSize,rows,cols) = self.gridMeta.tolist()
+        rows = int(rows)
+        cols = int(cols)
+        if rows == 0 :
+            return np.zeros(0,dtype=np.int64)
+
+        # Cells of a row are contiguous in gridNodes; a small margin covers
+        # the difference between projection and great-circle distance
+        margin = radius * 1.01 + 1
+        x = ( lon - lon0 ) * kx
+        y = ( lat - lat0 ) * METERS_PER_DEGREE
+        x0 = max(math.floor(( x - margin ) / cellSize),0)
+        x1 = min(math.floor(( x + margin ) / cellSize),cols-1)
+        y0 = max(math.floor(( y - margin ) / cellSize),0)
+        y1 = min(math.floor(( y + margin ) / cellSize),rows-1)
+        if x0 > x1 or y0 > y1 :
+            return np.zeros(0,dtype=np.int64)
+
+        rowStarts = np.arange(y0,y1+1) * cols
+        starts = self.gridOffsets[rowStarts + x0]
+        ends   = self.gridOffsets[rowStarts + x1 + 1]
+        candidates = np.concatenate([ self.gridNodes[a:b] for a,b in zip(starts.tolist(),ends.tolist()) ]).astype(np.int64)
+
+        distances = distanceArray(self.lat[candidates],self.lon[candidates],lat,lon)
+        inside = distances <= radius
+        candidates = candidates[inside]
+        return candidates[np.argsort(distances[inside],kind="stable")]
+
+    def node(self,i) :
+        """Build a display Node object for node index i"""
+        from OSMHandler import Node
+        node = Node(int(self.nodeIds[i]),float(self.lat[i]),float(self.lon[i]),dict(self.sigObjects[self.nodeSig[i]].tags))
+        for e in range(self.offsets[i],self.offsets[i+1]) :
+            node.ways.setdefault(int(self.wayIds[self.edgeWay[e]]),[]).append(int(self.nodeIds[self.neighbors[e]]))
+        return node
+
+class NodeView(Mapping):
+    """Read-only dict-like access to nodes of a CompactGraph, building Node objects on demand"""
+    def __init__(self,graph) :
+        self.graph = graph
+
+    def __getitem__(self,nid) :
+        i = self.graph.index(nid)
+        if i < 0 :
+            raise KeyError(nid)
+        return self.graph.node(i)
+
+    def __contains__(self,nid) :
+        return self.graph.index(nid) >= 0
+
+    def __iter__(self) :
+        return iter(self.graph.nodeIds.tolist())
+
+    def __len__(self) :
+        return self.graph.nodeCount()
+
+class WayView(Mapping):
+    """Read-only dict-like access to ways of a CompactGraph, building Way objects on demand"""
+    def __init__(self,graph) :
+        self.graph = graph
+
+    def __getitem__(self,wid) :
+        w = self.graph.wayIndex(wid)
+        if w < 0 :
+            raise KeyError(wid)
+        return self.graph.way(w)
+
+    def __contains__(self,wid) :
+        return self.graph.wayIndex(wid) >= 0
+
+    def __iter__(self) :
+        return iter(self.graph.wayIds.tolist())
+
+    def __len__(self) :
+        return len(self.graph.wayIds)
@@ -0,0 +1,169 @@
+import numpy as np
+
+class ContractedGraph:
+    """Degree-2 chains of a CompactGraph collapsed into super-edges
+
+    A node is interior if it has exactly two edges to two different other
+    nodes, e.g. the shape points of a way. All other nodes are core nodes and
+    super-edge s leads from core node superSource[s] to core node superTarget[s]
+    along the original edges chainEdges[chainOffsets[s]:chainOffsets[s+1]].
+    Its cost under a rule set is the sum of the costs of these edges, so
+    searches on the core nodes find routes of the same cost as on the full
+    graph. Super-edges are grouped by source in superOffsets like the CSR
+    adjacency of the graph; superTwin is the same chain in the other direction.
+    Interior node v lies on super-edge chainOf[v] after chainPos[v] of its
+    edges, chainOf is -1 for core nodes. Cycles without any core node get one
+    of their nodes as core node.
+    """
+    def __init__(self,graph) :
+        self.graph = graph
+        (self.core,self.chainOf,self.chainPos,self.superOffsets,self.superSource,self.superTarget,
+         self.superTwin,self.chainOffsets,self.chainEdges) = self._build(graph)
+        self.costsFingerprint = None
+        self.costs = None
+
+    @staticmethod
+    def _build(graph) :
+        n = graph.nodeCount()
+        offsets   = graph.offsets.tolist()
+        neighbors = graph.neighbors.tolist()
+
+        degree = np.diff(graph.offsets)
+        # Interior: two edges to two different nodes other than itself
+        core = degree != 2
+        twoEdges = np.flatnonzero(degree == 2)
+        first  = graph.neighbors[graph.offsets[twoEdges]]
+        second = graph.neighbors[graph.offsets[twoEdges]+1]
+        core[twoEdges[(first == second) | (first == twoEdges) | (second == twoEdges)]] = True
+        core = core.tolist()
+
+        def walk(u,e) :
+            """Edges of the chain leaving core node u by edge e, up to the next core node"""
+            edges = [ e ]
+            previous = u
+            v = neighbors[e]
+            while not core[v] :
+                e = offsets[v]
+                if neighbors[e] == previous :
+                    e += 1
+                edges.append(e)
+                previous = v
+                v = neighbors[e]
+            return edges
+
+        # Interior nodes not reached from any core node form cycles, one of
+        # their nodes becomes a core node
+        reached = [ False ] * n
+        for u in range(n) :
+            if core[u] :
+                for e in range(offsets[u],offsets[u+1]) :
+                    for c in walk(u,e)[:-1] :
+                        reached[neighbors[c]] = True
+        for v in range(n) :
+            if not core[v] and not reached[v] :
+                core[v] = True
+                for c in walk(v,offsets[v])[:-1] :
+                    reached[neighbors[c]] = True
+
+        chainOf  = np.full(n,-1,dtype=np.int32)
+        chainPos = np.zeros(n,dtype=np.int32)
+        superOffsets = np.zeros(n+1,dtype=np.int64)
+        superSource  = []
+        superTarget  = []
+        chainOffsets = [ 0 ]
+        chainEdges   = []
+        for u in range(n) :
+            if core[u] :
+                for e in range(offsets[u],offsets[u+1]) :
+                    edges = walk(u,e)
+                    s = len(superTarget)
+                    for p,c in enumerate(edges[:-1]) :
+                        v = neighbors[c]
+                        if chainOf[v] < 0 :
+                            chainOf[v] = s
+                            chainPos[v] = p+1
+                    superSource.append(u)
+                    superTarget.append(neighbors[edges[-1]])
+                    chainEdges.extend(edges)
+                    chainOffsets.append(len(chainEdges))
+            superOffsets[u+1] = len(superTarget)
+
+        chainOffsets = np.array(chainOffsets,dtype=np.int64)
+        chainEdges   = np.array(chainEdges,dtype=np.int64)
+
+        # The reverse chain starts with the twin of the last edge
+        superByFirst = np.empty(graph.edgeCount(),dtype=np.int64)
+        superByFirst[chainEdges[chainOffsets[:-1]]] = np.arange(len(superTarget))
+        superTwin = superByFirst[graph.twin[chainEdges[chainOffsets[1:]-1]]]
+
+        return (np.array(core),chainOf,chainPos,superOffsets,
+                np.array(superSource,dtype=np.int32),np.array(superTarget,dtype=np.int32),
+                superTwin,chainOffsets,chainEdges)
+
+    def coreCount(self) :
+        return int(np.count_nonzero(self.core))
+
+    def superCosts(self,compiled) :
+        """Cost of every super-edge for compiled rules, -1 if one of its edges has a negative penalty"""
+        if self.costsFingerprint != compiled.fingerprint :
+            costs = compiled.edgeCosts()[self.chainEdges]
+            starts = self.chainOffsets[:-1]
+            superCosts = np.add.reduceat(costs,starts) if len(starts) > 0 else np.zeros(0)
+            if len(starts) > 0 :
+                superCosts[np.minimum.reduceat(costs,starts) < 0] = -1
+            self.costs = superCosts
+            self.costsFingerprint = compiled.fingerprint
+        return self.costs
+
+    def chain(self,s) :
+        return self.chainEdges[self.chainOffsets[s]:self.chainOffsets[s+1]].tolist()
+
+    def exits(self,v) :
+        """(core node,edges from v to it) for the core nodes next to node index v"""
+        s = int(self.chainOf[v])
+        if s < 0 :
+            return [ (v,[]) ]
+        p = int(self.chainPos[v])
+        t = int(self.superTwin[s])
+        back = self.chain(t)
+        return [ (int(self.superTarget[s]),self.chain(s)[p:]),
+                 (int(self.superTarget[t]),back[len(back)-p:]) ]
+
+    def entries(self,v) :
+        """(core node,edges from it to v) for the core nodes next to node index v"""
+        s = int(self.chainOf[v])
+        if s < 0 :
+            return [ (v,[]) ]
+        p = int(self.chainPos[v])
+        t = int(self.superTwin[s])
+        back = self.chain(t)
+        return [ (int(self.superSource[s]),self.chain(s)[:p]),
+                 (int(self.superSource[t]),back[:len(back)-p]) ]
+
+    def direct(self,v,w) :
+        """Edges from interior node v to interior node w on the same chain, None if on different chains"""
+        s = int(self.chainOf[v])
+        if s < 0 or self.chainOf[w] < 0 :
+            return None
+        t = int(self.superTwin[s])
+        length = int(self.chainOffsets[s+1] - self.chainOffsets[s])
+        p = int(self.chainPos[v])
+        if self.chainOf[w] == s :
+            q = int(self.chainPos[w])
+        elif self.chainOf[w] == t :
+            q = length - int(self.chainPos[w])
+        else :
+            return None
+        if q >= p :
+            return self.chain(s)[p:q]
+        return self.chain(t)[length-p:length-q]
+
+    def chainNodes(self,superEdges) :
+        """Node indices along the given super-edges"""
+        if len(superEdges) == 0 :
+            return np.zeros(0,dtype=np.int64)
+        superEdges = np.asarray(superEdges,dtype=np.int64)
+        starts = self.chainOffsets[superEdges]
+        counts = self.chainOffsets[superEdges+1] - starts
+        edges = self.chainEdges[np.repeat(starts - np.cumsum(counts) + counts,counts) + np.arange(counts.sum())]
+        return self.graph.neighbors[edges]
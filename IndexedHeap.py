@@ -0,0 +1,112 @@
+import functools
+import heapq
+
+class Positions(dict) :
+    """Heap positions of nodes keyed by arbitrary ids, -1 for nodes not in the heap"""
+    def __missing__(self,node) :
+        return -1
+
+class IndexedHeap:
+    """Array-backed binary min-heap of (key,node) entries with decrease-key
+
+    Every node is in the heap at most once: push() of a node already in it
+    replaces its entry in place (the key must not grow), so pop() never returns
+    obsolete entries. Nodes are compact node indices below size, whose
+    positions are kept in a list, or with size None any hashable ids kept in a
+    dict. Entries compare like the tuples pushed with heapq, so nodes settle in
+    the same order.
+    """
+    def __init__(self,size=None) :
+        self.heap = []
+        self.position = Positions() if size is None else [ -1 ] * size
+
+    def __len__(self) :
+        return len(self.heap)
+
+    def minKey(self) :
+        return self.heap[0][0]
+
+    def push(self,entry) :
+        heap = self.heap
+        position = self.position
+        node = entry[1]
+        i = position[node]
+        if i < 0 :
+            i = len(heap)
+            heap.append(entry)
+        while i > 0 :
+            parent = (i - 1) >> 1
+            parentEntry = heap[parent]
+            if parentEntry < entry :
+                break
+            heap[i] = parentEntry
+            position[parentEntry[1]] = i
+            i = parent
+        heap[i] = entry
+        position[node] = i
+
+    def pop(self) :
+        """Remove and return the smallest entry"""
+        heap = self.heap
+        position = self.position
+        last = heap.pop()
+        n = len(heap)
+        if n == 0 :
+            position[last[1]] = -1
+            return last
+        top = heap[0]
+        position[top[1]] = -1
+        # As heapq does: move the smaller child up all the way down to a leaf,
+        # then sift the last entry up from there, fewer comparisons on average
+        i = 0
+        child = 1
+        while child < n :
+            right = child + 1
+            if right < n and heap[right] < heap[child] :
+                child = right
+            childEntry = heap[child]
+            heap[i] = childEntry
+            position[childEntry[1]] = i
+            i = child
+            child = 2*i + 1
+        while i > 0 :
+            parent = (i - 1) >> 1
+            parentEntry = heap[parent]
+            if parentEntry < last :
+                break
+            heap[i] = parentEntry
+            position[parentEntry[1]] = i
+            i = parent
+        heap[i] = last
+        position[last[1]] = i
+        return top
+
+    def rekey(self,entries) :
+        """Replace the content by entries, e.g. all open nodes with the keys for a new goal"""
+        position = self.position
+        for (_,node) in self.heap :
+            position[node] = -1
+        self.heap = list(entries)
+        heapq.heapify(self.heap)
+        for i,(_,node) in enumerate(self.heap) :
+            position[node] = i
+
+class LazyHeap(list) :
+    """heapq with lazy deletion behind the IndexedHeap interface
+
+    push() of a node already in the heap adds another entry, the obsolete one
+    is returned by pop() later as well and has to be skipped by the search.
+    push() and pop() are the heapq functions bound to the list, as fast as
+    calling them directly.
+    """
+    def __init__(self,size=None) :
+        list.__init__(self)
+        self.push = functools.partial(heapq.heappush,self)
+        self.pop  = functools.partial(heapq.heappop,self)
+
+    def minKey(self) :
+        return self[0][0]
+
+    def rekey(self,entries) :
+        self[:] = entries
+        heapq.heapify(self)
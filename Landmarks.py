@@ -0,0 +1,162 @@
+import heapq
+import math
+
+import numpy as np
+
+from CompactGraph import attachArrays, readSnapshot, shareArrays, writeSnapshot
+
+def sumDown32(a,b) :
+    """Largest float32 value not above a+b, for non-negative finite a and b"""
+    s = a + b
+    (m,e) = math.frexp(s)
+    k = math.floor(m * 16777216)
+    if k == m * 16777216 :
+        # s is a float32 value itself, step down if the float64 sum rounded up
+        bb = s - a
+        if ( a - ( s - bb ) ) + ( b - bb ) < 0 :
+            k -= 1
+    return math.ldexp(k,e-24)
+
+def shortestDistances(graph,costs,source) :
+    """Cost from node index source to every node (inf where unreachable) by Dijkstra, as float32
+
+    Every sum is rounded down to float32, so for every edge the distance of its
+    end is at most the distance of its start plus the edge cost, and the
+    float32 distances give a consistent A* bound without any rounding slack.
+    """
+    offsets   = memoryview(graph.offsets)
+    neighbors = memoryview(graph.neighbors)
+    costs     = memoryview(costs)
+
+    distances = [ math.inf ] * graph.nodeCount()
+    distances[source] = 0
+    closedList = dict()
+    openList = [ (0,source) ]
+
+    while len(openList)>0 :
+        currentCost,current = heapq.heappop(openList)
+        if current in closedList :
+            continue
+        closedList[current] = True
+        for e in range(offsets[current],offsets[current+1]) :
+            nxt = neighbors[e]
+            nextCost = sumDown32(currentCost,costs[e])
+            if nextCost < distances[nxt] :
+                distances[nxt] = nextCost
+                heapq.heappush(openList,(nextCost,nxt))
+
+    return np.array(distances,dtype=np.float32)
+
+class Landmarks:
+    """ALT landmarks: costs from a few landmark nodes to all nodes under one rule set
+
+    By the triangle inequality |d(L,t) - d(L,v)| is a lower bound of the cost
+    from v to t (the graph has every segment in both directions with the same
+    cost). It stays a lower bound for every rule set whose edge costs are not
+    below the ones used here, in particular for zero penalties and any learned
+    non-negative rules. The distances are kept as float32, rounded down while
+    they are summed up, see shortestDistances().
+    """
+    def __init__(self,nodes,distances,costs,fingerprint) :
+        self.nodes       = nodes
+        self.distances   = distances
+        self.costs       = costs
+        self.fingerprint = fingerprint
+        self.validFor    = dict()
+        # Only the landmarks giving the best bound between start and goal are used
+        self.active      = 4
+
+    @classmethod
+    def compute(cls,graph,compiled,count=16) :
+        """Pick count landmarks by farthest selection and compute their cost arrays"""
+        costs = compiled.edgeCosts()
+        if np.any(costs < 0) :
+            raise ValueError("Landmarks need non-negative edge costs")
+        reachable = np.flatnonzero(np.diff(graph.offsets) > 0)
+        if len(reachable) == 0 :
+            return cls(np.zeros(0,dtype=np.int32),np.zeros((0,graph.nodeCount()),dtype=np.float32),costs,compiled.fingerprint)
+
+        # Start far away from an arbitrary node, then repeatedly take the node
+        # farthest from all landmarks chosen so far
+        seed = shortestDistances(graph,costs,int(reachable[0]))
+        nextLandmark = int(np.argmax(np.where(np.isfinite(seed),seed,-1)))
+
+        # Filled row by row, without a float64 copy of all rows
+        nodes = []
+        distances = np.empty((count,graph.nodeCount()),dtype=np.float32)
+        nearest = np.full(graph.nodeCount(),np.inf)
+        for _ in range(count) :
+            row = shortestDistances(graph,costs,nextLandmark)
+            distances[len(nodes)] = row
+            nodes.append(nextLandmark)
+            nearest = np.minimum(nearest,row)
+            candidates = np.where(np.isfinite(nearest),nearest,-1)
+            candidates[nodes] = -1
+            nextLandmark = int(np.argmax(candidates))
+            if candidates[nextLandmark] <= 0 :
+                break
+
+        if len(nodes) < count :
+            distances = distances[:len(nodes)].copy()
+        return cls(np.array(nodes,dtype=np.int32),distances,costs,compiled.fingerprint)
+
+    def save(self,filename,source=None) :
+        writeSnapshot(filename,
+                      { "nodes" : self.nodes, "distances" : self.distances, "costs" : self.costs },
+                      { "source" : source, "rules" : self.fingerprint })
+
+    @classmethod
+    def load(cls,filename,graph,fingerprint,source=None) :
+        """Memory-map saved landmarks, None if missing or made for another graph or rule set"""
+        result = readSnapshot(filename)
+        if result is None :
+            return None
+        (header,arrays) = result
+        if header["source"] != source or header["rules"] != fingerprint :
+            return None
+        if arrays["distances"].dtype != np.float32 or arrays["distances"].shape[1:] != (graph.nodeCount(),) or \
+           len(arrays["costs"]) != graph.edgeCount() :
+            return None
+        return cls(arrays["nodes"],arrays["distances"],arrays["costs"],fingerprint)
+
+    def share(self) :
+        """Publish the landmark arrays in shared memory, see CompactGraph.share()"""
+        (block,layout) = shareArrays({ "nodes" : self.nodes, "distances" : self.distances, "costs" : self.costs })
+        return (block,{ "name" : block.name, "layout" : layout, "rules" : self.fingerprint })
+
+    @classmethod
+    def attach(cls,handle) :
+        (block,arrays) = attachArrays(handle["name"],handle["layout"])
+        landmarks = cls(arrays["nodes"],arrays["distances"],arrays["costs"],handle["rules"])
+        landmarks.sharedMemory = block
+        return landmarks
+
+    def valid(self,compiled) :
+        """Whether the bounds hold for a compiled rule set, i.e. no edge got cheaper"""
+        valid = self.validFor.get(compiled.fingerprint)
+        if valid is None :
+            valid = bool(np.all(compiled.edgeCosts() >= self.costs))
+            self.validFor[compiled.fingerprint] = valid
+        return valid
+
+    def boundTo(self,goal,start) :
+        """Lower bound of the cost from a node index to node index goal as function
+
+        Only the active landmarks with the best bound between start and goal are
+        used, and the bound is computed only for the nodes asked for.
+        """
+        toGoal = self.distances[:,goal]
+        bound = np.abs(toGoal - self.distances[:,start])
+        bound[~np.isfinite(bound)] = -1
+        active = np.argsort(-bound,kind="stable")[:self.active].tolist()
+        rows = [ (memoryview(self.distances[a]),float(toGoal[a])) for a in active ]
+        inf = math.inf
+
+        def bound(v) :
+            result = 0.0
+            for (distances,goalDistance) in rows :
+                difference = abs(distances[v] - goalDistance)
+                if difference > result and difference != inf :
+                    result = difference
+            return result
+        return bound
@@ -1,6 +1,28 @@
 import osmium as osm
 import math
-import heapq
+from collections import OrderedDict
+
+import numpy as np
+
+from CompactGraph import CompactGraph, CompactGraphBuilder, NodeView, WayView, snapshotSource, sourceFingerprint, updateSnapshotSource
+from ContractedGraph import ContractedGraph
+from IndexedHeap import IndexedHeap, LazyHeap
+from Landmarks import Landmarks
+from RouteCache import RouteCache
+from RuleEngine import CompiledRules, ruleFingerprint
+from TiledGraph import TiledGraph
+from log import log
+
+class NegativeWeightsError(ValueError) :
+    """The rules give a segment negative costs, which the searches cannot handle"""
+
+def greatCircle(lat1,lon1,lat2,lon2) :
+    theta = lon1 - lon2
+    dist = math.sin(math.radians(lat1)) * math.sin(math.radians(lat2)) + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.cos(math.radians(theta))
+    dist = math.degrees(math.acos(min(dist,1)))
+    dist = dist * 60 * 1.1515
+    dist = dist * 1.609344 * 1000
+    return dist
 
 class Node:
     def __init__(self,id,lat,lon,tags) :
@@ -36,20 +58,208 @@ class Way:
 
 
 class OSMHandler(osm.SimpleHandler) :
-    def __init__(self,override):
+    def __init__(self,override,compact=False,cache=False,routableOnly=False):
         osm.SimpleHandler.__init__(self)
+        self.override = override
+        # In compact mode nodes and ways are collected into a CompactGraph,
+        # nodes/ways then are views building Node/Way objects on demand
+        self.graph = None
+        self.builder = CompactGraphBuilder() if compact else None
         self.nodes = dict()
         self.ways = dict()
-        self.override = override
+        # With cache the compact graph is stored next to the source file and
+        # memory-mapped on later runs as long as the source file is unchanged
+        self.cache = compact and cache
+        self.cacheName = None
+        # Last few rule sets compiled against the compact graph, by fingerprint
+        self.compiledRules = OrderedDict()
+        self.compiledRulesSize = 8
+        # Search used by route(): "astar", "bidirectional" or "contracted" (compact mode only)
+        self.searchMode = "astar"
+        # Counters of the last search, e.g. settled nodes and stale heap pops
+        self.lastSearchStats = dict()
+        # Open list of the searches: "lazy" (heapq, obsolete entries are skipped
+        # when popped) or "indexed" (IndexedHeap with decrease-key, no obsolete
+        # entries but its sifting runs in Python, see benchmark.py)
+        self.priorityQueue = "lazy"
+        # ALT landmarks tighten the heuristic once prepareLandmarks() was called
+        self.landmarks = None
+        # Settled nodes of all searches since startRegion(), None if not recorded
+        self.region = None
+        # With routableOnly a first pass over the ways collects the nodes of
+        # highways and only those are kept, see routableNodes()
+        self.routableOnly = routableOnly
+        self.routable = None
+        # Threads decoding blocks of PBF and compressed input, 0 for osmium's
+        # default (environment variable OSMIUM_POOL_THREADS or the cores)
+        self.threads = 0
+        # Only load nodes inside (minlat,minlon,maxlat,maxlon) if set
+        self.bbox = None
+        # Tiled graph store from openTiles(), tiles are loaded as searches reach them
+        self.tiles = None
+        # Degree-2 chains collapsed for search mode "contracted", see contractedGraph()
+        self.contracted = None
+        # Results of route() and routeMany() by nodes and rule content, None to
+        # disable. Not used while a region is recorded, a cached route has none.
+        self.routeCache = RouteCache()
+
+    def cacheFile(self,filename) :
+        return filename + ".graph"
+
+    def apply_file(self,filename,*args,**kwargs) :
+        self.clearRouteCache()
+        if self.cache :
+            self.cacheName = self.cacheFile(filename)
+            # As stored in the JSON header of the cache
+            bbox = list(self.bbox) if self.bbox is not None else None
+            # The source is only hashed again if its size or mtime changed
+            previous = snapshotSource(self.cacheFile(filename))
+            source = dict(sourceFingerprint(filename,previous),routableOnly=self.routableOnly,bbox=bbox)
+            if previous is not None and previous != source and dict(previous,mtime=source["mtime"]) == source :
+                # Same content under a new mtime: keep the cache and its landmarks and
+                # store the new mtime, or keep using the old one if it does not fit
+                if updateSnapshotSource(self.cacheFile(filename),previous,source) :
+                    updateSnapshotSource(self.cacheName+".landmarks",previous,source)
+                else :
+                    source = previous
+            graph = CompactGraph.load(self.cacheFile(filename),source)
+            if graph is not None :
+                log("Using graph cache",self.cacheFile(filename))
+                self.setGraph(graph)
+                self.builder = None
+                return
+
+        # The format (.osm, .osm.pbf, .osm.bz2, .osm.gz, ...) follows from the
+        # file name, compressed input is decompressed while reading
+        pool = osm.io.ThreadPool(self.threads)
+        if self.routableOnly :
+            self.routable = self.routableNodes(filename,pool)
+        if len(args) > 0 or len(kwargs) > 0 :
+            osm.SimpleHandler.apply_file(self,filename,*args,**kwargs)
+        else :
+            # Only highway ways are used, the others are dropped inside osmium
+            reader = osm.io.Reader(filename,osm.osm.NODE|osm.osm.WAY,pool)
+            try :
+                osm.apply(reader,osm.filter.KeyFilter("highway").enable_for(osm.osm.WAY),self)
+            finally :
+                reader.close()
+        self.routable = None
+        if self.builder is not None :
+            self.setGraph(self.builder.build())
+            self.builder = None
+            if self.cache :
+                self.graph.save(self.cacheFile(filename),source)
+                log("Wrote graph cache",self.cacheFile(filename))
+
+    def routableNodes(self,filename,pool=None) :
+        """osmium IdSet of all nodes referenced by highway ways
+
+        Only ways are read and the highway filter runs in osmium, so this pass
+        is cheap compared to the main one and the set takes a few bits per id.
+        """
+        routable = osm.index.IdSet()
+        ways = osm.FileProcessor(filename,osm.osm.WAY,pool).with_filter(osm.filter.KeyFilter("highway"))
+        for w in ways :
+            for node in w.nodes :
+                routable.set(node.ref)
+        return routable
+
+    def writeTiles(self,directory,tileSize=0.05) :
+        """Store the compact graph as tiles of tileSize degrees for openTiles()"""
+        if self.graph is None :
+            raise ValueError("Tiles need compact mode")
+        TiledGraph.write(self.graph,directory,tileSize,self.graph.source)
+
+    def openTiles(self,directory,memoryBudget=256 << 20) :
+        """Route on a tiled graph written by writeTiles() instead of a loaded map
+
+        Tiles are read as route() expands into them and at most about
+        memoryBudget bytes of them are kept.
+        """
+        self.graph = None
+        self.contracted = None
+        self.landmarks = None
+        self.compiledRules.clear()
+        self.clearRouteCache()
+        self.tiles = TiledGraph(directory,memoryBudget)
+        self.nodes = NodeView(self.tiles)
+        self.ways = WayView(self.tiles)
+
+    def setGraph(self,graph) :
+        self.graph = graph
+        self.tiles = None
+        self.contracted = None
+        self.clearRouteCache()
+        self.nodes = NodeView(graph)
+        self.ways = WayView(graph)
+
+    def share(self) :
+        """Publish the compact graph and landmarks in shared memory for worker processes
+
+        Returns a small picklable handle for OSMHandler.attach(). Workers then use
+        the same physical memory read-only instead of parsing or unpickling the
+        graph. Call unshare() once the workers are done.
+        """
+        if self.graph is None :
+            raise ValueError("Sharing needs compact mode")
+        self.unshare()
+        (block,graphHandle) = self.graph.share()
+        self.sharedMemory = [ block ]
+        landmarksHandle = None
+        if self.landmarks is not None :
+            (block,landmarksHandle) = self.landmarks.share()
+            self.sharedMemory += [ block ]
+        return { "override"   : self.override,
+                 "searchMode" : self.searchMode,
+                 "graph"      : graphHandle,
+                 "landmarks"  : landmarksHandle }
+
+    def unshare(self) :
+        for block in getattr(self,"sharedMemory",[]) :
+            block.close()
+            block.unlink()
+        self.sharedMemory = []
+
+    @classmethod
+    def attach(cls,handle) :
+        """Handler on a graph published by share() in another process"""
+        handler = cls(handle["override"])
+        handler.setGraph(CompactGraph.attach(handle["graph"]))
+        handler.searchMode = handle["searchMode"]
+        if handle["landmarks"] is not None :
+            handler.landmarks = Landmarks.attach(handle["landmarks"])
+        return handler
+
+    def clearRouteCache(self) :
+        if self.routeCache is not None :
+            self.routeCache.clear()
+
+    def cachedRoutes(self) :
+        """routeCache if routes may be taken from it and stored in it now, else None"""
+        return self.routeCache if self.region is None else None
 
     def node(self, n):
+        if self.routable is not None and not n.id in self.routable :
+            return
+        if self.bbox is not None :
+            (minlat,minlon,maxlat,maxlon) = self.bbox
+            if not ( minlat <= n.location.lat <= maxlat and minlon <= n.location.lon <= maxlon ) :
+                return
+        if self.builder is not None :
+            self.builder.addNode(n.id,n.location.lat,n.location.lon,n.tags)
+            return
         self.nodes[n.id] = Node(n.id,
                                 n.location.lat,
                                 n.location.lon,
                                 { key : value for (key,value) in n.tags } )
 
     def way(self, w):
-        if "highway" in w.tags :
+        if "highway" in w.tags and self.builder is not None :
+            tags = [ (key,value) for (key,value) in w.tags ]
+            if not "sidewalk" in w.tags :
+                tags.append(("sidewalk","unknown"))
+            self.builder.addWay(w.id,[ node.ref for node in w.nodes ],tags)
+        elif "highway" in w.tags :
             self.ways[w.id] = Way(w.id,
                                     [ node.ref for node in w.nodes ],
                                     { key : value for (key,value) in w.tags } )
@@ -57,24 +267,17 @@ class OSMHandler(osm.SimpleHandler) :
             if not "sidewalk" in w.tags :
                 self.ways[w.id].tags["sidewalk"]="unknown"
 
-            if len(w.nodes)==1 :
-                self.nodes[w.nodes[0].ref].ways[w.id] = []
-            else :
-                self.nodes[w.nodes[0].ref].ways[w.id] = [w.nodes[1].ref]
-                for i in range(1,len(w.nodes)-1) : 
-                    self.nodes[w.nodes[i].ref].ways[w.id] = [w.nodes[i-1].ref,w.nodes[i+1].ref]
-                self.nodes[w.nodes[len(w.nodes)-1].ref].ways[w.id] = [w.nodes[len(w.nodes)-2].ref]
+            # Nodes can be missing in clipped extracts or outside of bbox
+            refs = [ node.ref for node in w.nodes ]
+            for i in range(len(refs)) :
+                if refs[i] in self.nodes :
+                    self.nodes[refs[i]].ways[w.id] = [ refs[j] for j in (i-1,i+1) if 0 <= j < len(refs) and refs[j] in self.nodes ]
 
     def relation(self, r):
         pass
 
     def distance(self,node1,node2) :
-        theta = node1.lon - node2.lon
-        dist = math.sin(math.radians(node1.lat)) * math.sin(math.radians(node2.lat)) + math.cos(math.radians(node1.lat)) * math.cos(math.radians(node2.lat)) * math.cos(math.radians(theta))
-        dist = math.degrees(math.acos(min(dist,1)))
-        dist = dist * 60 * 1.1515
-        dist = dist * 1.609344 * 1000
-        return dist
+        return greatCircle(node1.lat,node1.lon,node2.lat,node2.lon)
 
     def penalty(self,dictTupleRules,lastnode,nextnode,way) :
         lengthPenalty = 0
@@ -159,42 +362,427 @@ class OSMHandler(osm.SimpleHandler) :
         return rules
 
 
+    def prepareLandmarks(self,count=16,dictTupleRules=(dict(),dict()),filename=None) :
+        """Load or compute ALT landmarks for the compact graph, stored next to the graph cache
+
+        Landmarks computed without rules stay valid for all non-negative rules.
+        """
+        if self.graph is None :
+            raise ValueError("Landmarks need the compact graph, not tiles or object mode")
+        compiled = self.compileRules(dictTupleRules)
+        if filename is None and self.cacheName is not None :
+            filename = self.cacheName + ".landmarks"
+
+        landmarks = None
+        if filename is not None :
+            landmarks = Landmarks.load(filename,self.graph,compiled.fingerprint,self.graph.source)
+        if landmarks is None or len(landmarks.nodes) < min(count,len(self.graph.nodeIds)) :
+            log("Computing",count,"landmarks")
+            landmarks = Landmarks.compute(self.graph,compiled,count)
+            if filename is not None :
+                landmarks.save(filename,self.graph.source)
+        self.landmarks = landmarks
+        return landmarks
+
+    def heuristic(self,goal,start,compiled) :
+        """Lower bound of the cost from a node index to goal as function, using landmarks when they are valid
+
+        It is only evaluated for the nodes a search pushes, so the cost of a
+        search does not grow with the size of the graph.
+        """
+        distance = self.graph.distanceTo(goal)
+        if self.landmarks is None or not self.landmarks.valid(compiled) :
+            return distance
+        bound = self.landmarks.boundTo(goal,start)
+        return lambda v : max(distance(v),bound(v))
+
+    def compileRules(self,dictTupleRules) :
+        """CompiledRules for the compact graph, reused while the rule content is unchanged"""
+        fingerprint = ruleFingerprint(dictTupleRules)
+        compiled = self.compiledRules.get(fingerprint)
+        if compiled is None :
+            graph = self.graph if self.graph is not None else self.tiles
+            compiled = CompiledRules(dictTupleRules,graph,self.override,fingerprint)
+            self.compiledRules[fingerprint] = compiled
+            if len(self.compiledRules) > self.compiledRulesSize :
+                self.compiledRules.popitem(last=False)
+        else :
+            self.compiledRules.move_to_end(fingerprint)
+        return compiled
+
+    def stepRules(self,dictTupleRules,lastnid,nid,wid,compiled=None) :
+        """penaltyRules() for a path step given by node and way ids
+
+        Pass compiled from compileRules() when stepping along a whole path,
+        fingerprinting the rules for every step is expensive.
+        """
+        if self.graph is not None :
+            graph = self.graph
+            if compiled is None :
+                compiled = self.compileRules(dictTupleRules)
+            return compiled.penaltyRules(int(graph.nodeSig[graph.index(lastnid)]),
+                                         int(graph.nodeSig[graph.index(nid)]),
+                                         int(graph.waySig[graph.wayIndex(wid)]))
+        return self.penaltyRules(dictTupleRules,self.nodes[lastnid],self.nodes[nid],self.ways[wid])
+
+    def newOpenList(self,size=None) :
+        """Empty open list for compact node indices below size, or for any node ids with size None"""
+        if self.priorityQueue == "lazy" :
+            return LazyHeap(size)
+        if self.priorityQueue != "indexed" :
+            raise ValueError("Unknown priority queue "+str(self.priorityQueue))
+        return IndexedHeap(size)
+
+    def searchDone(self,*closedLists,stalePops=0) :
+        """Record the counters of a search: settled nodes, heap pops and the pops of obsolete entries among them"""
+        settled = sum( len(closedList) for closedList in closedLists )
+        self.lastSearchStats = { "settled" : settled, "pops" : settled + stalePops, "stalePops" : stalePops }
+        if self.region is not None :
+            self.region.extend(closedLists)
+
+    def startRegion(self) :
+        """Start recording the nodes settled by the following searches, see regionTags()"""
+        self.region = []
+
+    def regionTags(self) :
+        """Tags as used in rules ("N:tag==value", "W:tag==value") of all edges scanned since startRegion()
+
+        A search result can only change when the cost of one of these edges changes,
+        so rules not matching any of them cannot affect the recorded searches.
+        """
+        region = self.region
+        self.region = None
+        tags = set()
+
+        if self.graph is None :
+            for closedList in region :
+                for nid in closedList :
+                    node = self.nodes[nid]
+                    tags |= { "N:"+tag+"=="+value for tag,value in node.tags.items() }
+                    for wid,nids in node.ways.items() :
+                        tags |= { "W:"+tag+"=="+value for tag,value in self.ways[wid].tags.items() }
+                        for nxt in nids :
+                            tags |= { "N:"+tag+"=="+value for tag,value in self.nodes[nxt].tags.items() }
+            return tags
+
+        graph = self.graph
+        nodes = np.unique(np.fromiter(( node for closedList in region for node in closedList ),dtype=np.int64))
+        starts = graph.offsets[nodes]
+        counts = graph.offsets[nodes+1] - starts
+        edges = np.repeat(starts - np.cumsum(counts) + counts,counts) + np.arange(counts.sum())
+
+        sigStrings = graph.sigStrings()
+        for sig in np.unique(np.concatenate([ graph.nodeSig[nodes], graph.nodeSig[graph.neighbors[edges]] ])).tolist() :
+            tags |= { "N:"+item for item in sigStrings[sig] }
+        for sig in np.unique(graph.waySig[graph.edgeWay[edges]]).tolist() :
+            tags |= { "W:"+item for item in sigStrings[sig] }
+        return tags
+
     def multiRoute(self,nids,dictTupleRules=(dict(),dict())) :
-        totalCost = 0
-        totalPath = []
+        return self.multiRoutes([ nids ],dictTupleRules)[0]
+
+    def multiRoutes(self,routes,dictTupleRules=(dict(),dict())) :
+        """multiRoute() for several node lists at once, legs starting at the same node share a search"""
+        pairs = [ (nids[i],nids[i+1]) for nids in routes for i in range(len(nids)-1) ]
+        legs = iter(self.routeBatch(pairs,dictTupleRules))
+
+        results = []
+        for nids in routes :
+            totalCost = 0
+            totalPath = []
+
+            for i in range(len(nids)-1) :
+                (cost,path) = next(legs)
+                totalCost += cost
+                totalPath += path
 
-        for i in range(len(nids)-1) :
-            (cost,path) = self.route(nids[i],nids[i+1],dictTupleRules)
-            totalCost += cost
-            totalPath += path
+            results.append((totalCost,totalPath))
+        return results
 
-        return (totalCost,totalPath)
+    def routeBatch(self,pairs,dictTupleRules=(dict(),dict())) :
+        """route() for a list of (nid1,nid2) pairs, with one routeMany() search per distinct start node"""
+        targets = dict()
+        for nid1,nid2 in pairs :
+            targets.setdefault(nid1,dict())[nid2] = None
+
+        results = dict()
+        for nid1,nids in targets.items() :
+            nids = list(nids)
+            if len(nids) == 1 :
+                found = [ self.route(nid1,nids[0],dictTupleRules) ]
+            else :
+                found = self.routeMany(nid1,nids,dictTupleRules)
+            for nid2,result in zip(nids,found) :
+                results[(nid1,nid2)] = result
+
+        return [ results[pair] for pair in pairs ]
+
+    def routeMany(self,nid1,nids,dictTupleRules=(dict(),dict())) :
+        """route() from nid1 to every node in nids with one search, list of (cost,path) in order of nids"""
+        if self.graph is None :
+            return [ self.route(nid1,nid2,dictTupleRules) for nid2 in nids ]
+
+        graph = self.graph
+        start = graph.index(nid1)
+        if start < 0 :
+            raise KeyError(nid1)
+        goals = []
+        for nid2 in nids :
+            goal = graph.index(nid2)
+            if goal < 0 :
+                raise KeyError(nid2)
+            goals.append(goal)
+
+        compiled = self.compileRules(dictTupleRules)
+        cache = self.cachedRoutes()
+        results = dict()
+        if cache is not None :
+            for nid2 in nids :
+                result = cache.get((nid1,nid2,compiled.fingerprint,self.override))
+                if result is not None :
+                    results[nid2] = result
+        missing = [ (nid2,goal) for nid2,goal in zip(nids,goals) if not nid2 in results ]
+        if len(missing) > 0 :
+            (closedList,found) = self.settleTargets(start,[ goal for (_,goal) in missing ],compiled)
+            for nid2,goal in missing :
+                if goal in found :
+                    result = (found[goal],self.compactPath(start,self.parentEdgeChain(closedList,start,goal),compiled))
+                    if cache is not None :
+                        cache.put((nid1,nid2,compiled.fingerprint,self.override),result)
+                else :
+                    print("Bad luck")
+                    result = (0,[])
+                results[nid2] = result
+        return [ results[nid2] for nid2 in nids ]
+
+    def settleTargets(self,start,goals,compiled,guided=True) :
+        """Search from node index start until all goals are settled
+
+        Settled nodes keep their optimal cost when the heuristic changes, so the
+        goals are taken one after another, farthest first, and the search goes on
+        towards the next goal not settled yet with the open list re-keyed by its
+        heuristic. Without guided it is a single Dijkstra search.
+        Returns the edge used to reach each settled node and the cost of each
+        reached goal, both keyed by node index.
+        """
+        graph = self.graph
+        costs     = memoryview(compiled.edgeCosts())
+        offsets   = memoryview(graph.offsets)
+        neighbors = memoryview(graph.neighbors)
+        heuristic = lambda v : 0.0
+
+        openList = self.newOpenList(graph.nodeCount())
+        closedList = dict() # edge index used to reach each settled node, -1 for the start
+        openListData = dict()
+        goalSet = set(goals)
+        found = dict()
+        stalePops = 0
+
+        if offsets[start] == offsets[start+1] :
+            return (closedList,found)
+
+        openList.push((0,start))
+        openListData[start] = (0,-1)
+
+        order = list(goalSet)
+        if guided :
+            distance = graph.distanceTo(start)
+            order.sort(key=lambda goal : -distance(goal))
+
+        for goal in order :
+            if goal in closedList :
+                continue
+            if guided :
+                heuristic = self.heuristic(goal,start,compiled)
+                openList.rekey([ (cost + heuristic(node),node) for node,(cost,_) in openListData.items() ])
+
+            while len(openList)>0 and not goal in closedList :
+                currentValue,current = openList.pop()
+
+                if current in closedList :
+                    stalePops += 1
+                    continue
+
+                currentCost,parentEdge = openListData.pop(current)
+
+                closedList[current] = parentEdge
+                if current in goalSet :
+                    found[current] = currentCost
+
+                for e in range(offsets[current],offsets[current+1]) :
+                    nxt = neighbors[e]
+                    if nxt in closedList :
+                        continue
+
+                    segmentCost = costs[e]
+                    if segmentCost < 0 :
+                        self.negativeWeights(compiled,e)
+
+                    nextCost = currentCost + segmentCost
+
+                    if nxt in openListData :
+                        otherCost , _ = openListData[nxt]
+                        if otherCost < nextCost :
+                            continue
+                    openListData[nxt]=(nextCost,e)
+                    nextHeuristic = nextCost + heuristic(nxt)
+                    openList.push((nextHeuristic,nxt))
+
+        self.searchDone(closedList,stalePops=stalePops)
+        return (closedList,found)
+
+    def costMatrix(self,sources,targets,dictTupleRules=(dict(),dict()),paths=False) :
+        """Route costs from every node in sources to every node in targets as NumPy array
+
+        One Dijkstra search per source runs until all targets are settled, or,
+        without paths and with fewer targets than sources, one backward search
+        per target. Unreachable pairs are inf. With paths the result is
+        (costs,paths) where paths[i][j] is the route() path or None.
+        Needs compact mode.
+        """
+        if self.graph is None :
+            raise ValueError("costMatrix needs compact mode")
+        graph = self.graph
+        starts = [ graph.index(nid) for nid in sources ]
+        goals  = [ graph.index(nid) for nid in targets ]
+        for nid,i in zip(list(sources)+list(targets),starts+goals) :
+            if i < 0 :
+                raise KeyError(nid)
+
+        compiled = self.compileRules(dictTupleRules)
+        costs = compiled.edgeCosts()
+        negative = np.flatnonzero(costs < 0)
+        if len(negative) > 0 :
+            self.negativeWeights(compiled,int(negative[0]))
+
+        matrix = np.full((len(starts),len(goals)),np.inf)
+        costs = costs.tolist()
+
+        if paths :
+            pathMatrix = []
+            for i,start in enumerate(starts) :
+                (closedList,found) = self.settleTargets(start,goals,compiled,guided=False)
+                row = []
+                for j,goal in enumerate(goals) :
+                    if goal in found :
+                        matrix[i,j] = found[goal]
+                        row.append(self.compactPath(start,self.parentEdgeChain(closedList,start,goal),compiled))
+                    else :
+                        row.append(None)
+                pathMatrix.append(row)
+            return (matrix,pathMatrix)
+
+        if len(goals) < len(starts) :
+            reverseCosts = compiled.reverseEdgeCosts().tolist()
+            for j,goal in enumerate(goals) :
+                found = self.settleCosts(goal,starts,reverseCosts)
+                matrix[:,j] = [ found.get(start,np.inf) for start in starts ]
+        else :
+            for i,start in enumerate(starts) :
+                found = self.settleCosts(start,goals,costs)
+                matrix[i,:] = [ found.get(goal,np.inf) for goal in goals ]
+        return matrix
+
+    def settleCosts(self,start,goals,costs) :
+        """Costs from node index start to the goals by Dijkstra on the given edge costs, keyed by node index
+
+        Only costs, no paths, for costMatrix(). The costs must not be negative
+        and are best passed as list, plain lists index faster than arrays.
+        """
+        graph = self.graph
+        (offsets,neighbors) = graph.adjacencyLists()
+
+        distances = [ math.inf ] * graph.nodeCount()
+        distances[start] = 0
+        settled = bytearray(graph.nodeCount())
+        goalSet = set(goals)
+        remaining = len(goalSet)
+        found = dict()
+        stalePops = 0
+        openList = self.newOpenList(graph.nodeCount())
+        push = openList.push
+        pop  = openList.pop
+        push((0,start))
+
+        while openList :
+            currentCost,current = pop()
+            if settled[current] :
+                stalePops += 1
+                continue
+            settled[current] = 1
+
+            if current in goalSet :
+                found[current] = currentCost
+                remaining -= 1
+                if remaining == 0 :
+                    break
+
+            for e in range(offsets[current],offsets[current+1]) :
+                nextCost = currentCost + costs[e]
+                nxt = neighbors[e]
+                if nextCost < distances[nxt] :
+                    distances[nxt] = nextCost
+                    push((nextCost,nxt))
+
+        self.searchDone(np.flatnonzero(np.frombuffer(settled,dtype=np.uint8)),stalePops=stalePops)
+        return found
+
+    def route(self,nid1,nid2,dictTupleRules=(dict(),dict()),mode=None) :
+        """Cheapest (cost,path) from nid1 to nid2, taken from routeCache if routed with the same rules before"""
+        cache = self.cachedRoutes()
+        if cache is None :
+            return self.search(nid1,nid2,dictTupleRules,mode)
+        key = (nid1,nid2,ruleFingerprint(dictTupleRules),self.override)
+        result = cache.get(key)
+        if result is None :
+            result = self.search(nid1,nid2,dictTupleRules,mode)
+            cache.put(key,result)
+        return result
+
+    def search(self,nid1,nid2,dictTupleRules=(dict(),dict()),mode=None) :
+        """route() without routeCache, by search mode (default searchMode)"""
+        if mode is None :
+            mode = self.searchMode
+        if mode == "bidirectional" :
+            if self.graph is None :
+                raise ValueError("Bidirectional search needs compact mode")
+            return self.routeBidirectional(nid1,nid2,dictTupleRules)
+        if mode == "contracted" :
+            if self.graph is None :
+                raise ValueError("Contracted search needs compact mode")
+            return self.routeContracted(nid1,nid2,dictTupleRules)
+        if mode != "astar" :
+            raise ValueError("Unknown search mode "+str(mode))
+        if self.graph is not None :
+            return self.routeCompact(nid1,nid2,dictTupleRules)
+        if self.tiles is not None :
+            return self.routeTiled(nid1,nid2,dictTupleRules)
 
-    def route(self,nid1,nid2,dictTupleRules=(dict(),dict())) :
         node1 = self.nodes[nid1]
         node2 = self.nodes[nid2]
 
-        openList = []
-        closedList = dict() # for hashed access
+        openList = self.newOpenList()
+        closedList = dict() # for hashed access, holds the predecessor step of settled nodes
         openListData = dict()
+        stalePops = 0
         
-        heapq.heappush(openList,(0,nid1))
-        openListData[nid1] = (0,[ (list(node1.ways.keys())[0],nid1,0,0) ])
+        openList.push((0,nid1))
+        openListData[nid1] = (0,None,(list(node1.ways.keys())[0],nid1,0,0))
 
         while len(openList)>0 :
-            currentValue,currentId = heapq.heappop(openList)
+            currentValue,currentId = openList.pop()
 
-            if currentId in closedList : # As long obsolete routes are not removed due to heapq implementation
+            if currentId in closedList : # Obsolete entry of the lazy open list
+                stalePops += 1
                 continue
 
-            currentCost,currentPath = openListData.pop(currentId)
+            currentCost,parentId,step = openListData.pop(currentId)
 
-            # nextPath = currentPath + [currentId]
+            closedList[currentId] = (parentId,step)
 
             if currentId == nid2 :
-                return (currentCost,currentPath)
-
-            closedList[currentId] = True
+                self.searchDone(closedList,stalePops=stalePops)
+                return (currentCost,self.pathFromParents(closedList,currentId))
 
             currentNode = self.nodes[currentId]
 
@@ -212,7 +800,7 @@ class OSMHandler(osm.SimpleHandler) :
                         if lengthPenalty < 0 or pointPenalty < 0 :
                             log("Error: Negative weights! ",lengthPenalty,pointPenalty,prio=10)
                             log(" -> From:",currentNode," To: ",nextNode," Way: ",way,prio=10)
-                            exit(1)
+                            raise NegativeWeightsError("Negative weights "+str((lengthPenalty,pointPenalty))+" from "+str(currentNode.id)+" to "+str(nextNode.id))
 
                         # max to prevent negativity
                         segmentCost = segmentLength * ( 1 + max( lengthPenalty , 0 ) ) + max( 0 , pointPenalty )
@@ -220,16 +808,483 @@ class OSMHandler(osm.SimpleHandler) :
                         nextCost = currentCost + segmentCost
 
                         if nid in openListData :
-                            otherCost , _ = openListData[nid]
+                            otherCost , _ , _ = openListData[nid]
                             if otherCost < nextCost :
                                 continue
-                            # remove obsolete entry from priority queue - not done due to heapq implementation
-                        openListData[nid]=(nextCost,currentPath + [ (wid,nid,segmentCost,segmentLength) ] )
+                            # the indexed open list replaces the entry of nid, the lazy one keeps it as obsolete
+                        openListData[nid]=(nextCost,currentId,(wid,nid,segmentCost,segmentLength))
                         nextHeuristic = nextCost + self.distance(nextNode,node2)
-                        heapq.heappush(openList,(nextHeuristic,nid))
+                        openList.push((nextHeuristic,nid))
+        self.searchDone(closedList,stalePops=stalePops)
         print("Bad luck")
         return (0,[])
 
+    def pathFromParents(self,closedList,nid) :
+        """Rebuild the (wid,nid,segmentCost,segmentLength) list from predecessor steps"""
+        path = []
+        while nid is not None :
+            (nid,step) = closedList[nid]
+            path.append(step)
+        path.reverse()
+        return path
+
+    def routeCompact(self,nid1,nid2,dictTupleRules=(dict(),dict())) :
+        graph = self.graph
+        start = graph.index(nid1)
+        goal  = graph.index(nid2)
+        if start < 0 :
+            raise KeyError(nid1)
+        if goal < 0 :
+            raise KeyError(nid2)
+
+        # memoryviews give plain Python ints/floats on indexing
+        compiled  = self.compileRules(dictTupleRules)
+        costs     = memoryview(compiled.edgeCosts())
+        offsets   = memoryview(graph.offsets)
+        neighbors = memoryview(graph.neighbors)
+        edgeWay   = memoryview(graph.edgeWay)
+        heuristic = self.heuristic(goal,start,compiled)
+
+        if offsets[start] == offsets[start+1] :
+            print("Bad luck")
+            return (0,[])
+
+        openList = self.newOpenList(graph.nodeCount())
+        closedList = dict() # edge index used to reach each settled node, -1 for the start
+        openListData = dict()
+        stalePops = 0
+
+        openList.push((0,start))
+        openListData[start] = (0,-1)
+
+        while len(openList)>0 :
+            currentValue,current = openList.pop()
+
+            if current in closedList :
+                stalePops += 1
+                continue
+
+            currentCost,parentEdge = openListData.pop(current)
+
+            closedList[current] = parentEdge
+
+            if current == goal :
+                self.searchDone(closedList,stalePops=stalePops)
+                return (currentCost,self.compactPath(start,self.parentEdgeChain(closedList,start,goal),compiled))
+
+            for e in range(offsets[current],offsets[current+1]) :
+                nxt = neighbors[e]
+                if nxt in closedList :
+                    continue
+
+                segmentCost = costs[e]
+                if segmentCost < 0 :
+                    self.negativeWeights(compiled,e)
+
+                nextCost = currentCost + segmentCost
+
+                if nxt in openListData :
+                    otherCost , _ = openListData[nxt]
+                    if otherCost < nextCost :
+                        continue
+                openListData[nxt]=(nextCost,e)
+                nextHeuristic = nextCost + heuristic(nxt)
+                openList.push((nextHeuristic,nxt))
+        self.searchDone(closedList,stalePops=stalePops)
+        print("Bad luck")
+        return (0,[])
+
+    def contractedGraph(self) :
+        """ContractedGraph of the compact graph, built on first use"""
+        if self.contracted is None :
+            self.contracted = ContractedGraph(self.graph)
+        return self.contracted
+
+    def routeContracted(self,nid1,nid2,dictTupleRules=(dict(),dict())) :
+        """A* over the core nodes of contractedGraph(), following whole degree-2 chains at once
+
+        Start and goal may be interior nodes of a chain, then the search starts
+        at or ends through the core nodes at both ends of their chain. The found
+        path is expanded to the original edges and its cost summed from the
+        start as in route().
+        """
+        graph = self.graph
+        start = graph.index(nid1)
+        goal  = graph.index(nid2)
+        if start < 0 :
+            raise KeyError(nid1)
+        if goal < 0 :
+            raise KeyError(nid2)
+
+        contracted   = self.contractedGraph()
+        compiled     = self.compileRules(dictTupleRules)
+        costs        = compiled.edgeCosts()
+        superCosts   = memoryview(contracted.superCosts(compiled))
+        superOffsets = memoryview(contracted.superOffsets)
+        superTarget  = memoryview(contracted.superTarget)
+        heuristic    = self.heuristic(goal,start,compiled)
+
+        if graph.offsets[start] == graph.offsets[start+1] :
+            print("Bad luck")
+            return (0,[])
+
+        def chainCost(edges) :
+            cost = 0
+            for e in edges :
+                if costs[e] < 0 :
+                    self.negativeWeights(compiled,e)
+                cost += float(costs[e])
+            return cost
+
+        # Node index -1 stands for the goal, reached from the core nodes next to it,
+        # the last of the nodeCount()+1 open list positions is left for it
+        openList = self.newOpenList(graph.nodeCount()+1)
+        closedList = dict() # (previous core node, super-edge) used to reach each settled core node
+        openListData = dict()
+        stalePops = 0
+
+        # Edges of the partial chains at start and goal, all of them are costed
+        endEdges = []
+
+        goalEntries = dict()
+        for (node,edges) in contracted.entries(goal) :
+            goalEntries.setdefault(node,[]).append((edges,chainCost(edges)))
+            endEdges += edges
+        goalCost = math.inf
+        goalParent = None
+
+        direct = contracted.direct(start,goal)
+        if direct is not None or start == goal :
+            goalCost = chainCost(direct or [])
+            goalParent = (None,direct or [])
+            openList.push((goalCost,-1))
+            endEdges += direct or []
+
+        for (node,edges) in contracted.exits(start) :
+            endEdges += edges
+            cost = chainCost(edges)
+            if node in openListData and openListData[node][0] <= cost :
+                continue
+            openListData[node] = (cost,(-1,edges))
+            openList.push((cost + heuristic(node),node))
+
+        scanned = []
+        while len(openList)>0 :
+            currentValue,current = openList.pop()
+
+            if current == -1 :
+                break
+
+            if current in closedList :
+                stalePops += 1
+                continue
+
+            currentCost,parent = openListData.pop(current)
+
+            closedList[current] = parent
+
+            for (edges,cost) in goalEntries.get(current,[]) :
+                if currentCost + cost < goalCost :
+                    goalCost = currentCost + cost
+                    goalParent = (current,edges)
+                    openList.push((goalCost,-1))
+
+            if self.region is not None :
+                scanned.append(range(superOffsets[current],superOffsets[current+1]))
+
+            for s in range(superOffsets[current],superOffsets[current+1]) :
+                nxt = superTarget[s]
+                if nxt in closedList :
+                    continue
+
+                segmentCost = superCosts[s]
+                if segmentCost < 0 :
+                    chainCost(contracted.chain(s))
+
+                nextCost = currentCost + segmentCost
+
+                if nxt in openListData :
+                    otherCost , _ = openListData[nxt]
+                    if otherCost < nextCost :
+                        continue
+                openListData[nxt]=(nextCost,(current,s))
+                nextHeuristic = nextCost + heuristic(nxt)
+                openList.push((nextHeuristic,nxt))
+
+        self.searchDone(closedList,stalePops=stalePops)
+        if self.region is not None :
+            # The nodes along scanned chains and the partial chains at start and goal belong to the region as well
+            chainNodes = contracted.chainNodes([ s for superEdges in scanned for s in superEdges ])
+            endEdges = np.asarray(endEdges,dtype=np.int64)
+            self.region.append(chainNodes.tolist() + graph.edgeSource()[endEdges].tolist() + graph.neighbors[endEdges].tolist() + [ start, goal ])
+        if goalParent is None :
+            print("Bad luck")
+            return (0,[])
+
+        (current,edges) = goalParent
+        edges = list(edges)
+        while current is not None :
+            (previous,s) = closedList[current]
+            if previous == -1 :
+                edges = s + edges
+                break
+            edges = contracted.chain(s) + edges
+            current = previous
+
+        path = self.compactPath(start,edges,compiled)
+        totalCost = 0
+        for (_,_,segmentCost,_) in path :
+            totalCost += segmentCost
+        return (totalCost,path)
+
+    def routeTiled(self,nid1,nid2,dictTupleRules=(dict(),dict())) :
+        """A* on the tiled graph, tiles are loaded when the search reaches them
+
+        Nodes are keyed by OSM id as in the object graph, edge costs are
+        computed per tile for the compiled rules.
+        """
+        tiles = self.tiles
+        (startTile,start) = tiles.locate(nid1)
+        (goalTile,goal)   = tiles.locate(nid2)
+        if start < 0 :
+            raise KeyError(nid1)
+        if goal < 0 :
+            raise KeyError(nid2)
+
+        compiled = self.compileRules(dictTupleRules)
+        tile = tiles.tile(goalTile)
+        (goalLat,goalLon) = (float(tile.lat[goal]),float(tile.lon[goal]))
+
+        tile = tiles.tile(startTile)
+        if tile.offsets[start] == tile.offsets[start+1] :
+            print("Bad luck")
+            return (0,[])
+
+        openList = self.newOpenList()
+        closedList = dict() # for hashed access, holds the predecessor step of settled nodes
+        openListData = dict()
+        stalePops = 0
+
+        openList.push((0,nid1,startTile,start))
+        openListData[nid1] = (0,None,(int(tile.edgeWayId[tile.offsets[start]]),nid1,0,0))
+
+        while len(openList)>0 :
+            currentValue,currentId,t,current = openList.pop()
+
+            if currentId in closedList :
+                stalePops += 1
+                continue
+
+            currentCost,parentId,step = openListData.pop(currentId)
+
+            closedList[currentId] = (parentId,step)
+
+            if currentId == nid2 :
+                self.searchDone(closedList,stalePops=stalePops)
+                return (currentCost,self.pathFromParents(closedList,currentId))
+
+            tile = tiles.tile(t)
+            costs = tiles.edgeCosts(tile,compiled)
+            (offsets,neighborIds,neighborTile,neighborIndex,neighborLat,neighborLon,edgeWayId,length) = tile.searchViews
+
+            for e in range(offsets[current],offsets[current+1]) :
+                nid = neighborIds[e]
+                if nid in closedList :
+                    continue
+
+                segmentCost = costs[e]
+                if segmentCost < 0 :
+                    log("Error: Negative weights! ",compiled.penalty(int(tile.nodeSig[current]),int(tile.neighborSig[e]),int(tile.edgeWaySig[e])),prio=10)
+                    log(" -> From:",self.nodes[currentId]," To: ",self.nodes[nid]," Way: ",self.ways[edgeWayId[e]],prio=10)
+                    raise NegativeWeightsError("Negative weights from "+str(currentId)+" to "+str(nid))
+
+                nextCost = currentCost + segmentCost
+
+                if nid in openListData :
+                    otherCost , _ , _ = openListData[nid]
+                    if otherCost < nextCost :
+                        continue
+                openListData[nid]=(nextCost,currentId,(edgeWayId[e],nid,segmentCost,length[e]))
+                nextHeuristic = nextCost + greatCircle(neighborLat[e],neighborLon[e],goalLat,goalLon)
+                openList.push((nextHeuristic,nid,neighborTile[e],neighborIndex[e]))
+        self.searchDone(closedList,stalePops=stalePops)
+        print("Bad luck")
+        return (0,[])
+
+    def routeBidirectional(self,nid1,nid2,dictTupleRules=(dict(),dict())) :
+        """Bidirectional A* on the compact graph with average potentials
+
+        Forward and backward search run on the same reduced costs, using the
+        potential (h_goal - h_start)/2 and its negation, and stop once the sum of
+        both queue minima reaches the best meeting cost. The cost is summed along
+        the final path from the start, in the same order as route() does.
+        """
+        graph = self.graph
+        start = graph.index(nid1)
+        goal  = graph.index(nid2)
+        if start < 0 :
+            raise KeyError(nid1)
+        if goal < 0 :
+            raise KeyError(nid2)
+
+        compiled  = self.compileRules(dictTupleRules)
+        costs     = memoryview(compiled.edgeCosts())
+        backCosts = memoryview(compiled.reverseEdgeCosts())
+        offsets   = memoryview(graph.offsets)
+        neighbors = memoryview(graph.neighbors)
+        twin      = memoryview(graph.twin)
+        (toGoal,toStart) = (self.heuristic(goal,start,compiled),self.heuristic(start,goal,compiled))
+        potential = lambda v : ( toGoal(v) - toStart(v) ) / 2
+
+        if offsets[start] == offsets[start+1] :
+            print("Bad luck")
+            return (0,[])
+        if start == goal :
+            self.searchDone({ start : -1 })
+            return (0,self.compactPath(start,[],compiled))
+
+        # Tentative costs and the edge (in forward direction) each node was reached by
+        forwardCost  = { start : 0 }
+        backwardCost = { goal : 0 }
+        forwardEdge  = { start : -1 }
+        backwardEdge = { goal : -1 }
+        forwardClosed  = dict()
+        backwardClosed = dict()
+        forwardList  = self.newOpenList(graph.nodeCount())
+        backwardList = self.newOpenList(graph.nodeCount())
+        forwardList.push((potential(start),start))
+        backwardList.push((-potential(goal),goal))
+        stalePops = 0
+
+        bestCost = math.inf
+        meeting  = -1
+
+        while len(forwardList)>0 and len(backwardList)>0 :
+            forwardMin  = forwardList.minKey()
+            backwardMin = backwardList.minKey()
+            if forwardMin + backwardMin >= bestCost :
+                break
+
+            if forwardMin <= backwardMin :
+                _,current = forwardList.pop()
+                if current in forwardClosed :
+                    stalePops += 1
+                    continue
+                forwardClosed[current] = True
+                currentCost = forwardCost[current]
+                for e in range(offsets[current],offsets[current+1]) :
+                    nxt = neighbors[e]
+                    if nxt in forwardClosed :
+                        continue
+                    segmentCost = costs[e]
+                    if segmentCost < 0 :
+                        self.negativeWeights(compiled,e)
+                    nextCost = currentCost + segmentCost
+                    if nxt in forwardCost and forwardCost[nxt] <= nextCost :
+                        continue
+                    forwardCost[nxt] = nextCost
+                    forwardEdge[nxt] = e
+                    forwardList.push((nextCost + potential(nxt),nxt))
+                    if nxt in backwardCost and nextCost + backwardCost[nxt] < bestCost :
+                        bestCost = nextCost + backwardCost[nxt]
+                        meeting  = nxt
+            else :
+                _,current = backwardList.pop()
+                if current in backwardClosed :
+                    stalePops += 1
+                    continue
+                backwardClosed[current] = True
+                currentCost = backwardCost[current]
+                for e in range(offsets[current],offsets[current+1]) :
+                    nxt = neighbors[e]
+                    if nxt in backwardClosed :
+                        continue
+                    segmentCost = backCosts[e]
+                    if segmentCost < 0 :
+                        self.negativeWeights(compiled,twin[e])
+                    nextCost = currentCost + segmentCost
+                    if nxt in backwardCost and backwardCost[nxt] <= nextCost :
+                        continue
+                    backwardCost[nxt] = nextCost
+                    backwardEdge[nxt] = twin[e]
+                    backwardList.push((nextCost - potential(nxt),nxt))
+                    if nxt in forwardCost and nextCost + forwardCost[nxt] < bestCost :
+                        bestCost = nextCost + forwardCost[nxt]
+                        meeting  = nxt
+
+        self.searchDone(forwardClosed,backwardClosed,stalePops=stalePops)
+        if meeting < 0 :
+            print("Bad luck")
+            return (0,[])
+
+        edges = self.parentEdgeChain(forwardEdge,start,meeting)
+        current = meeting
+        while current != goal :
+            e = backwardEdge[current]
+            edges.append(e)
+            current = neighbors[e]
+
+        path = self.compactPath(start,edges,compiled)
+        totalCost = 0
+        for (_,_,segmentCost,_) in path :
+            totalCost += segmentCost
+        return (totalCost,path)
+
+    def parentEdgeChain(self,parentEdges,start,goal) :
+        """Edge indices from start to goal given the edge used to reach each node"""
+        edgeSource = self.graph.edgeSource()
+        edges = []
+        current = goal
+        while current != start :
+            e = parentEdges[current]
+            edges.append(e)
+            current = int(edgeSource[e])
+        edges.reverse()
+        return edges
+
+    def compactPath(self,start,edges,compiled) :
+        """(wid,nid,segmentCost,segmentLength) list for a chain of edges from node index start"""
+        graph = self.graph
+        costs = compiled.edgeCosts()
+        path = [ (int(graph.wayIds[graph.edgeWay[graph.offsets[start]]]),int(graph.nodeIds[start]),0,0) ]
+        for e in edges :
+            path.append((int(graph.wayIds[graph.edgeWay[e]]),int(graph.nodeIds[graph.neighbors[e]]),float(costs[e]),float(graph.length[e])))
+        return path
+
+    def negativeWeights(self,compiled,e) :
+        graph = self.graph
+        current = int(graph.edgeSource()[e])
+        nxt = int(graph.neighbors[e])
+        w = int(graph.edgeWay[e])
+        (lengthPenalty,pointPenalty,_) = compiled.penalty(int(graph.nodeSig[current]),int(graph.nodeSig[nxt]),int(graph.waySig[w]))
+        log("Error: Negative weights! ",lengthPenalty,pointPenalty,prio=10)
+        log(" -> From:",graph.node(current)," To: ",graph.node(nxt)," Way: ",graph.way(w),prio=10)
+        raise NegativeWeightsError("Negative weights "+str((lengthPenalty,pointPenalty))+" from "+str(int(graph.nodeIds[current]))+" to "+str(int(graph.nodeIds[nxt])))
+
+    def location(self,nid) :
+        if self.graph is not None :
+            i = self.graph.index(nid)
+            if i < 0 :
+                raise KeyError(nid)
+            return (float(self.graph.lat[i]),float(self.graph.lon[i]))
+        node = self.nodes[nid]
+        return (node.lat,node.lon)
+
+    def nearestNode(self,lat,lon) :
+        """OSM id of the routable node nearest to lat/lon, from the spatial grid of the compact graph"""
+        if self.graph is None :
+            raise ValueError("nearestNode needs compact mode")
+        i = self.graph.nearest(lat,lon)
+        if i < 0 :
+            raise KeyError((lat,lon))
+        return int(self.graph.nodeIds[i])
+
+    def nodesInRadius(self,lat,lon,radius) :
+        """OSM ids of the routable nodes within radius meters of lat/lon, nearest first"""
+        if self.graph is None :
+            raise ValueError("nodesInRadius needs compact mode")
+        return self.graph.nodeIds[self.graph.inRadius(lat,lon,radius)].tolist()
+
     def gpxFromNodeList(self,nodes,filename=None) :
         if filename==None :
             filename = "route-"+str(nodes[0])+"-"+str(nodes[-1])+".gpx"
@@ -238,8 +1293,8 @@ class OSMHandler(osm.SimpleHandler) :
         f.write("<?xml version='1.0' encoding='UTF-8'?>")
         f.write("<gpx version='1.1'><trk><trkseg>")
         for nid in nodes :
-            node = self.nodes[nid]
-            f.write("<trkpt lat='"+str(node.lat)+"' lon='"+str(node.lon)+"'/>")
+            (lat,lon) = self.location(nid)
+            f.write("<trkpt lat='"+str(lat)+"' lon='"+str(lon)+"'/>")
         f.write("</trkseg></trk></gpx>")
         f.close()
         return filename
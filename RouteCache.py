@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+class RouteCache:
+    """LRU of route results keyed by (source,target,rule fingerprint,override)
+
+    Rule sets are identified by their content (see ruleFingerprint()), so any
+    change of the rules gives new keys and entries for old rule sets are
+    simply never hit again until they are evicted. The least recently used
+    entries are dropped once the estimated size of the cached paths exceeds
+    memoryBudget bytes. All search modes find optimal routes, so results are
+    shared between them.
+    """
+    # Rough size of a cached (cost,path) result and of one (wid,nid,cost,length) path step
+    entryBytes = 400
+    stepBytes  = 160
+
+    def __init__(self,memoryBudget=64 << 20) :
+        self.memoryBudget = memoryBudget
+        self.entries = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) :
+        return len(self.entries)
+
+    def size(self,result) :
+        return self.entryBytes + self.stepBytes * len(result[1])
+
+    def get(self,key) :
+        """Cached (cost,path) for key or None; the path is a copy the caller may change"""
+        result = self.entries.get(key)
+        if result is None :
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return (result[0],list(result[1]))
+
+    def put(self,key,result) :
+        if key in self.entries :
+            self.memory -= self.size(self.entries.pop(key))
+        (cost,path) = result
+        result = (cost,tuple(path))
+        self.entries[key] = result
+        self.memory += self.size(result)
+        while self.memory > self.memoryBudget and len(self.entries) > 0 :
+            (_,evicted) = self.entries.popitem(last=False)
+            self.memory -= self.size(evicted)
+            self.evictions += 1
+
+    def clear(self) :
+        """Drop all entries, e.g. when the graph changes; counters are kept"""
+        self.entries.clear()
+        self.memory = 0
+
+    def stats(self) :
+        return { "hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions,
+                 "entries" : len(self.entries), "memory" : self.memory }
@@ -0,0 +1,157 @@
+import hashlib
+
+import numpy as np
+
+def _canonical(dictTupleRules) :
+    return tuple( tuple(sorted( (item,tuple(score),_canonical(sub)) for item,(score,sub) in rules.items() )) for rules in dictTupleRules )
+
+def ruleFingerprint(dictTupleRules) :
+    """Stable content hash of a rule structure from rulesToDictTuple()"""
+    return hashlib.blake2b(repr(_canonical(dictTupleRules)).encode("utf-8"),digest_size=16).hexdigest()
+
+class CompiledRules:
+    """Rule structure from rulesToDictTuple() keyed on interned tag ids of a CompactGraph
+
+    Penalties only depend on the tag signatures of both nodes and the way of
+    an edge, so they are evaluated once per (node, node, way) signature triple
+    of the graph (see CompactGraph.edgeTriples()) and cached. edgeCosts() turns
+    that into one segment cost per graph edge.
+    """
+    def __init__(self,dictTupleRules,graph,override,fingerprint=None) :
+        self.graph = graph
+        self.override = override
+        self.fingerprint = fingerprint if fingerprint is not None else ruleFingerprint(dictTupleRules)
+        self.rules = self._compile(dictTupleRules,graph.tagIds())
+        self.penaltyCache = dict()
+        self.rulesCache = dict()
+        self.costs = None
+        self.reverseCosts = None
+
+    def _compile(self,dictTupleRules,tagIds) :
+        # Rules for tags that do not occur in the graph can never match
+        return tuple( { tagIds[item] : (score,self._compile(sub,tagIds),item)
+                        for item,(score,sub) in rules.items() if item in tagIds }
+                      for rules in dictTupleRules )
+
+    def _penalty(self,rules,sigs) :
+        lengthPenalty = 0
+        pointPenalty  = 0
+        penaltyCount  = 0
+
+        for t in range(3) :
+            table = rules[0] if t < 2 else rules[1]
+            if len(table) == 0 :
+                continue
+            for tid in sigs[t] :
+                if tid in table :
+                    ((lp,pp),sub,_) = table[tid]
+                    (lpa,ppa,subCount) = self._penalty(sub,sigs)
+
+                    penaltyCount += subCount
+
+                    if self.override :
+                        if subCount > 0 :
+                            lengthPenalty += lpa
+                            pointPenalty  += ppa
+                        else :
+                            penaltyCount  += 1
+
+                            lengthPenalty += lp
+                            pointPenalty  += pp
+                    else :
+                        penaltyCount += 1
+
+                        lengthPenalty += lp + lpa
+                        pointPenalty  += pp + ppa
+
+        return (lengthPenalty,pointPenalty,penaltyCount)
+
+    def _penaltyRules(self,rules,sigs) :
+        result = dict()
+
+        for t in range(3) :
+            if t < 2 :
+                table = rules[0]
+                p = "N:"
+            else :
+                table = rules[1]
+                p = "W:"
+            if len(table) == 0 :
+                continue
+            for tid in sigs[t] :
+                if tid in table :
+                    ((lp,pp),sub,item) = table[tid]
+                    subRules = self._penaltyRules(sub,sigs)
+
+                    if self.override :
+                        if len(subRules) > 0 :
+                            for subitem in subRules :
+                                result[p+item+" && "+subitem] = subRules[subitem]
+                        else :
+                            result[p+item]=(lp,pp)
+                    else :
+                        for subitem in subRules :
+                            result[p+item+" && "+subitem] = subRules[subitem]
+                        result[p+item] =(lp,pp)
+
+        return result
+
+    def penalty(self,sig1,sig2,wsig) :
+        """Same as OSMHandler.penalty() for two node signatures and a way signature"""
+        key = (sig1,sig2,wsig)
+        result = self.penaltyCache.get(key)
+        if result is None :
+            sigList = self.graph.sigList
+            result = self._penalty(self.rules,(sigList[sig1],sigList[sig2],sigList[wsig]))
+            self.penaltyCache[key] = result
+        return result
+
+    def penaltyRules(self,sig1,sig2,wsig) :
+        """Same as OSMHandler.penaltyRules() for two node signatures and a way signature"""
+        key = (sig1,sig2,wsig)
+        result = self.rulesCache.get(key)
+        if result is None :
+            sigList = self.graph.sigList
+            result = self._penaltyRules(self.rules,(sigList[sig1],sigList[sig2],sigList[wsig]))
+            self.rulesCache[key] = result
+        return result
+
+    def edgeCosts(self) :
+        """Segment cost of every edge, -1 where the rules give a negative penalty"""
+        if self.costs is None :
+            self.costs = self._edgeCosts()
+        return self.costs
+
+    def reverseEdgeCosts(self) :
+        """Cost of the opposite direction of every edge, for backward searches"""
+        if self.reverseCosts is None :
+            self.reverseCosts = self.edgeCosts()[self.graph.twin]
+        return self.reverseCosts
+
+    def empty(self) :
+        """Whether no rule matches any tag of the graph, then costs are the lengths"""
+        return len(self.rules[0]) == 0 and len(self.rules[1]) == 0
+
+    def _edgeCosts(self) :
+        graph = self.graph
+        if self.empty() :
+            return np.array(graph.length,dtype=np.float64)
+        (triples,tripleIndex) = graph.edgeTriples()
+        return self.segmentCosts(triples,tripleIndex,graph.length)
+
+    def segmentCosts(self,triples,tripleIndex,length) :
+        """Segment costs for edges given by signatureTriples() and lengths, -1 where a penalty is negative"""
+        if self.empty() :
+            return np.array(length,dtype=np.float64)
+
+        lengthPenalty = np.empty(len(triples))
+        pointPenalty  = np.empty(len(triples))
+        for i,(sig1,sig2,wsig) in enumerate(triples.tolist()) :
+            (lengthPenalty[i],pointPenalty[i],_) = self.penalty(sig1,sig2,wsig)
+
+        lengthPenalty = lengthPenalty[tripleIndex]
+        pointPenalty  = pointPenalty[tripleIndex]
+
+        costs = length * ( 1 + np.maximum( lengthPenalty , 0 ) ) + np.maximum( 0 , pointPenalty )
+        costs[(lengthPenalty < 0) | (pointPenalty < 0)] = -1
+        return costs
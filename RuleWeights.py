@@ -0,0 +1,199 @@
+import numpy as np
+
+from log import log
+
+def dualSimplex(A,b,c,iterations=None) :
+    """min c.x subject to A x <= b, x >= 0 for c >= 0, by the dual simplex method on a dense tableau
+
+    The slack basis is dual feasible for c >= 0, so no first phase is needed.
+    After a degenerate pivot, one that leaves the objective as it is, pivots
+    follow Bland's rule (smallest indices) until the objective moves again, so
+    the method cannot cycle. Returns x, or None if the constraints cannot be
+    satisfied or no solution was reached within iterations.
+    """
+    (m,n) = A.shape
+    tableau = np.zeros((m+1,n+m+1))
+    tableau[:m,:n] = A
+    tableau[:m,n:n+m] = np.eye(m)
+    tableau[:m,-1] = b
+    tableau[m,:n] = c
+    basis = np.arange(n,n+m)
+    tolerance = 1e-9 * ( 1 + np.abs(b).max(initial=0) )
+    bland = False
+    for _ in range(iterations or 50*(n+m)) :
+        if bland :
+            infeasible = np.flatnonzero(tableau[:m,-1] < -tolerance)
+            if len(infeasible) == 0 :
+                break
+            r = int(infeasible[np.argmin(basis[infeasible])])
+        else :
+            r = int(np.argmin(tableau[:m,-1]))
+            if tableau[r,-1] >= -tolerance :
+                break
+        row = tableau[r,:-1]
+        candidates = np.flatnonzero(row < -1e-12)
+        if len(candidates) == 0 :
+            return None
+        ratios = tableau[m,candidates] / -row[candidates]
+        best = ratios.min()
+        if bland :
+            k = int(candidates[np.flatnonzero(ratios <= best + 1e-12)[0]])
+        else :
+            k = int(candidates[np.argmin(ratios)])
+        bland = best <= 1e-12
+        tableau[r] /= tableau[r,k]
+        column = tableau[:,k].copy()
+        column[r] = 0
+        tableau -= np.outer(column,tableau[r])
+        basis[r] = k
+    if tableau[:m,-1].min(initial=0) < -tolerance :
+        return None
+    x = np.zeros(n+m)
+    x[basis] = tableau[:m,-1]
+    return np.maximum(x[:n],0)
+
+class RuleWeights:
+    """Rule penalties as NumPy array: weights[i] is (lenWeight,pointWeight) of rule keys[i]
+
+    Mirrors a rules dict, which stays the format passed to routing, and runs
+    the training updates as array operations. A path is a sparse feature
+    vector of rule indices with the (length,count) it was charged per rule.
+    Between startBatch() and finishBatch() updates are computed against the
+    weights at the start of the batch and summed, otherwise applied at once.
+    """
+    def __init__(self,rules=None) :
+        self.keys = []
+        self.index = dict()
+        self.weights = np.zeros((0,2))
+        self.base = None
+        self.pending = None
+        if rules is not None :
+            self.sync(rules)
+
+    def sync(self,rules) :
+        """Follow the keys of rules: index added rules with their weights, drop removed ones
+
+        Indices of the remaining rules shift down over removed ones, so features
+        have to be computed after sync().
+        """
+        removed = [ i for i,key in enumerate(self.keys) if key not in rules ]
+        added = [ key for key in rules if key not in self.index ]
+        if len(removed) > 0 :
+            keep = np.ones(len(self.keys),dtype=bool)
+            keep[removed] = False
+            self.keys = [ key for key,kept in zip(self.keys,keep.tolist()) if kept ]
+            self.index = { key : i for i,key in enumerate(self.keys) }
+            self.weights = self.weights[keep]
+            if self.pending is not None :
+                self.base = self.base[keep]
+                self.pending = self.pending[keep]
+        if len(added) == 0 :
+            return
+        for key in added :
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+        values = np.array([ rules[key] for key in added ],dtype=float).reshape(-1,2)
+        self.weights = np.concatenate([ self.weights, values ])
+        if self.pending is not None :
+            self.base = np.concatenate([ self.base, values ])
+            self.pending = np.concatenate([ self.pending, np.zeros_like(values) ])
+
+    def features(self,usedTags) :
+        """(indices,features) of a dict rule -> (length,count), without (0,0) entries"""
+        items = [ (self.index[key],value) for key,value in usedTags.items() if value != (0,0) ]
+        indices = np.array([ i for (i,_) in items ],dtype=np.int64)
+        features = np.array([ value for (_,value) in items ],dtype=float).reshape(-1,2)
+        return (indices,features)
+
+    def compensate(self,indices,features,error,factor) :
+        """Projected gradient step lowering the cost of a path by error*factor
+
+        Moves the weights of the rules the path uses along its features. Weights
+        that would get negative are clamped to 0 and drop out, the error they
+        could not take is spread over the remaining ones. Returns (remaining
+        error,remaining norm2); the error could not be compensated if norm2 <= 0.
+        """
+        features = features.copy()
+        # Sums in rule order as the scalar update did, so results match to the last bit
+        norm2 = sum(np.sum(features*features,axis=1).tolist())
+        weights = (self.weights if self.pending is None else self.base)[indices]
+        old = weights.copy()
+        while norm2 > 0 and error > 0 :
+            weights -= error * factor * features / norm2
+            clamped = weights < 0
+            nextNorm2 = norm2
+            nextError = 0
+            for (row,column) in zip(*np.nonzero(clamped)) :
+                count = float(features[row,column])
+                nextNorm2 -= count * count
+                nextError += -float(weights[row,column]) * count
+                log("Cannot compensate",self.keys[indices[row]],"wrt",("len","point")[column],"reuse error now",nextError,"weight",nextNorm2,"from",norm2)
+            weights[clamped] = 0
+            features[clamped] = 0
+            (error,norm2) = (nextError,nextNorm2)
+        if self.pending is None :
+            self.weights[indices] = weights
+        else :
+            self.pending[indices] += weights - old
+        return (error,norm2)
+
+    def startBatch(self) :
+        self.base = self.weights.copy()
+        self.pending = np.zeros_like(self.weights)
+
+    def finishBatch(self) :
+        """Apply the summed updates of the batch, clamped at 0"""
+        self.weights = np.maximum(self.base + self.pending,0)
+        self.base = None
+        self.pending = None
+
+    def store(self,rules) :
+        """Write changed weights back to rules, returns the number of changed rules"""
+        current = np.array([ rules[key] for key in self.keys ],dtype=float).reshape(-1,2)
+        changed = np.flatnonzero(( current != self.weights ).any(axis=1))
+        for i in changed.tolist() :
+            key = self.keys[i]
+            weights = (float(self.weights[i,0]),float(self.weights[i,1]))
+            log("Changing rule",key,"from",rules[key],"to",weights)
+            rules[key] = weights
+        return len(changed)
+
+    def solve(self,rows,offsets,groups,proximity=1e-3) :
+        """Non-negative weights for rows (indices,features) meaning features . weights[indices] + offset <= 0
+
+        Rows are grouped, e.g. by training case, and the sum of the largest
+        violation per group is minimized as linear program. Changing a weight
+        costs proximity times its change times the column norm, so weights the
+        rows do not determine stay where they are. Returns the violation of
+        every row, or None with the weights unchanged if the program was not
+        solved.
+        """
+        A = np.zeros((len(rows),2*len(self.keys)))
+        for j,(indices,features) in enumerate(rows) :
+            A[j,2*indices]   = features[:,0]
+            A[j,2*indices+1] = features[:,1]
+        offsets = np.asarray(offsets,dtype=float)
+        (groupList,group) = np.unique(np.asarray(groups),return_inverse=True)
+        start = self.weights.ravel().copy()
+        free = np.flatnonzero(np.abs(A).sum(axis=0) > 0)
+        f = len(free)
+        g = len(groupList)
+
+        # Variables: increase and decrease of the free weights, largest violation per group
+        #    A (increase - decrease) - violation[group] <= -(A start + offsets)
+        #    decrease <= start
+        S = np.zeros((len(rows),g))
+        S[np.arange(len(rows)),group] = -1
+        lp = np.block([ [ A[:,free], -A[:,free], S ],
+                        [ np.zeros((f,f)), np.eye(f), np.zeros((f,g)) ] ])
+        bounds = np.concatenate([ -(A @ start + offsets), start[free] ])
+        norms = np.abs(A[:,free]).sum(axis=0)
+        cost = np.concatenate([ proximity * norms, proximity * norms, np.ones(g) ])
+        x = dualSimplex(lp,bounds,cost)
+        if x is None :
+            return None
+
+        weights = start
+        weights[free] = np.maximum(start[free] + x[:f] - x[f:2*f],0)
+        self.weights = weights.reshape(-1,2)
+        return A @ weights + offsets
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+import os
+
+import numpy as np
+
+from CompactGraph import GraphLookup, TagSignature, readSnapshot, signatureTriples, writeSnapshot
+
+class Tile:
+    """Nodes of one tile with their outgoing edges
+
+    Edges carry everything a search needs about their end node (id, tile,
+    index in that tile, coordinates and tags), so expanding a node never
+    loads the tile of a neighbor before the search actually gets there.
+    """
+    arrayNames = ( "nodeIds", "lat", "lon", "nodeSig", "offsets",
+                   "neighborIds", "neighborTile", "neighborIndex", "neighborLat", "neighborLon", "neighborSig",
+                   "edgeWayId", "edgeWaySig", "length" )
+
+    def __init__(self,arrays) :
+        for name in self.arrayNames :
+            setattr(self,name,arrays[name])
+        # memoryviews give plain Python ints/floats on indexing in searches
+        self.searchViews = tuple( memoryview(getattr(self,name)) for name in
+                                  ( "offsets", "neighborIds", "neighborTile", "neighborIndex", "neighborLat", "neighborLon", "edgeWayId", "length" ) )
+        # Signature triples of the edges and their costs for the last compiled
+        # rule set, see TiledGraph.edgeCosts()
+        self.triples = None
+        self.costs = None
+        self.costsView = None
+        self.costsFingerprint = None
+
+    def nbytes(self) :
+        size = sum( getattr(self,name).nbytes for name in self.arrayNames )
+        if self.triples is not None :
+            size += self.triples[0].nbytes + self.triples[1].nbytes
+        if self.costs is not None :
+            size += self.costs.nbytes
+        return size
+
+    def index(self,nid) :
+        i = int(np.searchsorted(self.nodeIds,nid))
+        if i < len(self.nodeIds) and self.nodeIds[i] == nid :
+            return i
+        return -1
+
+class TiledGraph(GraphLookup):
+    """CompactGraph split into tiles of tileSize degrees, stored in a directory and loaded on demand
+
+    The index file keeps the node id to tile mapping, the ways and the
+    interned tags, memory-mapped like the graph cache. Tiles are memory-mapped
+    when first used and kept in an LRU, the least recently used ones are
+    dropped once the loaded tiles exceed memoryBudget bytes.
+    Shares index()/wayIndex()/way() with CompactGraph through GraphLookup and
+    builds node() from its tile, so NodeView, WayView and CompiledRules work on it.
+    """
+    indexName = "index.graph"
+
+    def __init__(self,directory,memoryBudget=256 << 20) :
+        result = readSnapshot(os.path.join(directory,self.indexName))
+        if result is None :
+            raise ValueError("No tiled graph in "+directory)
+        (header,arrays) = result
+        self.directory    = directory
+        self.memoryBudget = memoryBudget
+        self.tileSize     = header["tileSize"]
+        self.tileKeys     = [ tuple(key) for key in header["tiles"] ]
+        self.source       = header["source"]
+        self.nodeIds      = arrays["nodeIds"]
+        self.nodeTile     = arrays["nodeTile"]
+        self.wayIds       = arrays["wayIds"]
+        self.waySig       = arrays["waySig"]
+        self.wayOffsets   = arrays["wayOffsets"]
+        self.wayRefs      = arrays["wayRefs"]
+        self.tagList      = [ tuple(tag) for tag in header["tags"] ]
+        self.sigList      = [ tuple(sig) for sig in header["sigs"] ]
+        self.sigObjects   = [ TagSignature({ key : value for (key,value) in (self.tagList[t] for t in sig) }) for sig in self.sigList ]
+        self._tagIds = None
+
+        self.tiles = OrderedDict()
+        self.memory = 0
+        self.tileLoads = 0
+        self.tileEvictions = 0
+
+    @classmethod
+    def write(cls,graph,directory,tileSize=0.05,source=None) :
+        """Split a CompactGraph into tiles of tileSize degrees written to directory"""
+        os.makedirs(directory,exist_ok=True)
+
+        keys = np.stack([ np.floor(graph.lat / tileSize), np.floor(graph.lon / tileSize) ],axis=1).astype(np.int64)
+        (tileKeys,nodeTile) = np.unique(keys,axis=0,return_inverse=True)
+        nodeTile = nodeTile.reshape(-1).astype(np.int32)
+
+        # Index of every node within its tile; nodes are sorted by id, so are tiles
+        order = np.argsort(nodeTile,kind="stable")
+        bounds = np.searchsorted(nodeTile[order],np.arange(len(tileKeys)+1))
+        localIndex = np.empty(graph.nodeCount(),dtype=np.int32)
+        localIndex[order] = np.arange(graph.nodeCount()) - np.repeat(bounds[:-1],np.diff(bounds))
+
+        for t in range(len(tileKeys)) :
+            nodes = order[bounds[t]:bounds[t+1]]
+            starts = graph.offsets[nodes]
+            counts = graph.offsets[nodes+1] - starts
+            edges = np.repeat(starts - np.cumsum(counts) + counts,counts) + np.arange(counts.sum())
+            offsets = np.zeros(len(nodes)+1,dtype=np.int64)
+            np.cumsum(counts,out=offsets[1:])
+            neighbors = graph.neighbors[edges]
+            writeSnapshot(os.path.join(directory,cls.tileName(t)),
+                          { "nodeIds"       : graph.nodeIds[nodes],
+                            "lat"           : graph.lat[nodes],
+                            "lon"           : graph.lon[nodes],
+                            "nodeSig"       : graph.nodeSig[nodes],
+                            "offsets"       : offsets,
+                            "neighborIds"   : graph.nodeIds[neighbors],
+                            "neighborTile"  : nodeTile[neighbors],
+                            "neighborIndex" : localIndex[neighbors],
+                            "neighborLat"   : graph.lat[neighbors],
+                            "neighborLon"   : graph.lon[neighbors],
+                            "neighborSig"   : graph.nodeSig[neighbors],
+                            "edgeWayId"     : graph.wayIds[graph.edgeWay[edges]],
+                            "edgeWaySig"    : graph.waySig[graph.edgeWay[edges]],
+                            "length"        : graph.length[edges] },
+                          { "tile" : tileKeys[t].tolist() })
+
+        writeSnapshot(os.path.join(directory,cls.indexName),
+                      { "nodeIds"    : graph.nodeIds,
+                        "nodeTile"   : nodeTile,
+                        "wayIds"     : graph.wayIds,
+                        "waySig"     : graph.waySig,
+                        "wayOffsets" : graph.wayOffsets,
+                        "wayRefs"    : graph.wayRefs },
+                      { "tileSize" : tileSize,
+                        "tiles"    : tileKeys.tolist(),
+                        "source"   : source,
+                        "tags"     : graph.tagList,
+                        "sigs"     : graph.sigList })
+
+    @staticmethod
+    def tileName(t) :
+        return "tile-"+str(t)+".graph"
+
+    def tile(self,t) :
+        """Tile number t, loaded if needed and marked as most recently used"""
+        tile = self.tiles.get(t)
+        if tile is not None :
+            self.tiles.move_to_end(t)
+            return tile
+        (_,arrays) = readSnapshot(os.path.join(self.directory,self.tileName(t)))
+        tile = Tile(arrays)
+        self.tiles[t] = tile
+        self.memory += tile.nbytes()
+        self.tileLoads += 1
+        self.evict()
+        return tile
+
+    def evict(self) :
+        # The most recently used tile always stays, even if it alone exceeds the budget
+        while self.memory > self.memoryBudget and len(self.tiles) > 1 :
+            (_,tile) = self.tiles.popitem(last=False)
+            self.memory -= tile.nbytes()
+            self.tileEvictions += 1
+
+    def edgeCosts(self,tile,compiled) :
+        """Segment costs of the edges of a tile under compiled rules, -1 for negative penalties, as memoryview"""
+        if tile.costsFingerprint != compiled.fingerprint :
+            if tile.costs is not None :
+                self.memory -= tile.costs.nbytes
+            if compiled.empty() :
+                tile.costs = np.array(tile.length,dtype=np.float64)
+            else :
+                if tile.triples is None :
+                    sig1 = np.repeat(tile.nodeSig,np.diff(tile.offsets))
+                    tile.triples = signatureTriples(sig1,tile.neighborSig,tile.edgeWaySig,len(self.sigList))
+                    self.memory += tile.triples[0].nbytes + tile.triples[1].nbytes
+                tile.costs = compiled.segmentCosts(*tile.triples,tile.length)
+            tile.costsView = memoryview(tile.costs)
+            tile.costsFingerprint = compiled.fingerprint
+            self.memory += tile.costs.nbytes
+            self.evict()
+        return tile.costsView
+
+    def locate(self,nid) :
+        """(tile,index in tile) of an OSM node id, (-1,-1) if not present"""
+        i = self.index(nid)
+        if i < 0 :
+            return (-1,-1)
+        t = int(self.nodeTile[i])
+        return (t,self.tile(t).index(nid))
+
+    def node(self,i) :
+        """Build a display Node object for node index i, loading its tile"""
+        from OSMHandler import Node
+        nid = int(self.nodeIds[i])
+        tile = self.tile(int(self.nodeTile[i]))
+        j = tile.index(nid)
+        node = Node(nid,float(tile.lat[j]),float(tile.lon[j]),dict(self.sigObjects[tile.nodeSig[j]].tags))
+        for e in range(tile.offsets[j],tile.offsets[j+1]) :
+            node.ways.setdefault(int(tile.edgeWayId[e]),[]).append(int(tile.neighborIds[e]))
+        return node
@@ -0,0 +1,92 @@
+# Compares the search modes of OSMHandler.route on the legs of the training cases.
+#
+#    python benchmark.py [osmfile]
+#
+# Prints settled nodes and time per mode, with great-circle and with landmark (ALT)
+# heuristic, and checks that all modes give the same costs. Every mode runs with
+# the lazy heapq open list and with IndexedHeap (OSMHandler.priorityQueue), the
+# share of heap pops that were stale (obsolete entries of nodes reached again
+# cheaper) is printed for both. On a 63k node grid about 20% of the pops of A*
+# and 30% of the contracted search were stale, IndexedHeap has none but took
+# about 60% longer per route, its sifting runs in Python while heapq is C.
+# Then compares one search per leg to routeBatch(), which shares one search
+# among legs with the same start node, and routeBatch() with an empty and with
+# a filled OSMHandler.routeCache, all with the default open list.
+
+import sys
+import time
+
+from log import log
+from OSMHandler import OSMHandler
+from training import resolveCase
+from trainingcases import training
+
+osmfile = sys.argv[1] if len(sys.argv) > 1 else "mannheim-dbhw.osm"
+
+modes = [ ("astar",False), ("bidirectional",False), ("contracted",False), ("astar",True), ("bidirectional",True), ("contracted",True) ]
+queues = [ "lazy", "indexed" ]
+
+osmhandler = OSMHandler(True,True,True)
+osmhandler.apply_file(osmfile)
+
+legs = []
+for case in training :
+    case = resolveCase(osmhandler,case)
+    learnRoute = [ case[0] ] + case[2] + [ case[1] ]
+    if all( nid in osmhandler.nodes for nid in learnRoute ) :
+        legs += [ (case[0],case[1]) ]
+        legs += [ (learnRoute[i],learnRoute[i+1]) for i in range(len(learnRoute)-1) ]
+log("Legs from training cases:",len(legs),prio=10)
+
+results = dict()
+defaultQueue = osmhandler.priorityQueue
+for mode in modes :
+    (searchMode,alt) = mode
+    if alt and osmhandler.landmarks is None :
+        osmhandler.prepareLandmarks()
+    landmarks = osmhandler.landmarks
+    if not alt :
+        osmhandler.landmarks = None
+
+    for queue in queues :
+        osmhandler.priorityQueue = queue
+        settled = 0
+        pops = 0
+        stalePops = 0
+        costs = []
+        start = time.time()
+        for nid1,nid2 in legs :
+            (cost,_) = osmhandler.search(nid1,nid2,mode=searchMode)
+            settled += osmhandler.lastSearchStats["settled"]
+            pops += osmhandler.lastSearchStats["pops"]
+            stalePops += osmhandler.lastSearchStats["stalePops"]
+            costs += [ cost ]
+        results[mode,queue] = (settled,stalePops/max(pops,1),time.time()-start,costs)
+    osmhandler.landmarks = landmarks
+osmhandler.priorityQueue = defaultQueue
+
+(baseSettled,_,_,baseCosts) = results[modes[0],queues[0]]
+for mode in modes :
+    for queue in queues :
+        (settled,staleRatio,elapsed,costs) = results[mode,queue]
+        name = mode[0] + ( "+alt" if mode[1] else "" ) + " " + queue
+        log(f"{name:26s} settled {settled:9d} ({settled/max(baseSettled,1)*100:6.1f}%), stale pops {staleRatio*100:5.1f}% in {elapsed:7.2f}s, identical costs: {costs == baseCosts}, max difference: {max([ abs(a-b) for a,b in zip(costs,baseCosts) ],default=0):.2e}",prio=10)
+
+# Region recording collects the settled nodes of every search
+for name,run in [ ("per leg",lambda : [ osmhandler.route(nid1,nid2) for nid1,nid2 in legs ]),
+                  ("routeBatch",lambda : osmhandler.routeBatch(legs)) ] :
+    osmhandler.startRegion()
+    start = time.time()
+    costs = [ cost for (cost,_) in run() ]
+    elapsed = time.time()-start
+    settled = sum( len(closedList) for closedList in osmhandler.region )
+    osmhandler.region = None
+    log(f"{name:18s} settled {settled:9d} in {elapsed:7.2f}s, identical costs: {costs == baseCosts}",prio=10)
+
+# Routing the same legs with unchanged rules again takes them from routeCache
+osmhandler.routeCache.clear()
+for name in [ "routeBatch cold cache", "routeBatch warm cache" ] :
+    start = time.time()
+    costs = [ cost for (cost,_) in osmhandler.routeBatch(legs) ]
+    elapsed = time.time()-start
+    log(f"{name:22s} in {elapsed:7.2f}s, identical costs: {costs == baseCosts}, cache {osmhandler.routeCache.stats()}",prio=10)
@@ -0,0 +1,65 @@
+# Compares loading the same map from the different OSM file formats.
+#
+#    python loadbenchmark.py [osmfile] [threads]
+#
+# Writes osmfile as .osm, .osm.gz, .osm.bz2 and .osm.pbf next to it (once),
+# then loads each in compact mode without graph cache and prints the file size
+# and load time. threads is passed to OSMHandler.threads (0: osmium's default).
+#
+# Results for a 33 MB XML test extract (303k nodes, 79k ways, 19k of them
+# highways) on a single core:
+#
+#    format          size    load  routableOnly
+#    .osm          33.1MB   3.86s         4.01s
+#    .osm.gz        3.6MB   4.22s         3.71s
+#    .osm.bz2       2.8MB   4.18s         4.82s
+#    .osm.pbf       1.0MB   2.76s         2.02s
+#
+# PBF is parsed fastest and its blocks are decoded in parallel by the osmium
+# thread pool, so the gap grows with more cores. Most of the remaining time is
+# spent in the Python node() and way() callbacks. Download .osm.pbf extracts
+# where available (e.g. from download.geofabrik.de).
+
+import os
+import sys
+import time
+
+import osmium as osm
+
+from log import log
+from OSMHandler import OSMHandler
+
+osmfile = sys.argv[1] if len(sys.argv) > 1 else "mannheim-dbhw.osm"
+threads = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+base = osmfile
+for suffix in [ ".osm", ".xml" ] :
+    if base.endswith(suffix) :
+        base = base[:-len(suffix)]
+
+files = []
+for suffix in [ ".osm", ".osm.gz", ".osm.bz2", ".osm.pbf" ] :
+    filename = base + suffix
+    if not os.path.exists(filename) :
+        log("Writing",filename,prio=10)
+        writer = osm.SimpleWriter(filename)
+        for obj in osm.FileProcessor(osmfile) :
+            if isinstance(obj,osm.osm.Node) :
+                writer.add_node(obj)
+            elif isinstance(obj,osm.osm.Way) :
+                writer.add_way(obj)
+            elif isinstance(obj,osm.osm.Relation) :
+                writer.add_relation(obj)
+        writer.close()
+    files += [ filename ]
+
+log(f"{'format':10s} {'size':>9s} {'load':>7s} {'routableOnly':>13s}",prio=10)
+for filename in files :
+    times = []
+    for routableOnly in [ False, True ] :
+        osmhandler = OSMHandler(True,True,False,routableOnly)
+        osmhandler.threads = threads
+        start = time.time()
+        osmhandler.apply_file(filename)
+        times += [ time.time()-start ]
+    log(f"{filename[len(base):]:10s} {os.path.getsize(filename)/1e6:7.1f}MB {times[0]:6.2f}s {times[1]:12.2f}s",prio=10)
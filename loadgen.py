@@ -0,0 +1,92 @@
+# Load generator for routeservice.py, prints latency percentiles and throughput.
+#
+#    python loadgen.py [url] [concurrency] [requests] [sources]
+#
+# Each of concurrency clients sends /route requests over one kept-alive
+# connection, between node ids sampled from the service's /nodes. With a small
+# number of sources many concurrent requests start at the same node and are
+# coalesced by the service (see its /stats); 0 sources draws every start node
+# at random. Pairs in different parts of a disconnected map get no route (404),
+# failed requests are counted by status next to the latencies.
+
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+from log import log
+
+url         = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8080"
+concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+requests    = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+sources     = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+address = urlsplit(url)
+
+async def call(reader,writer,method,path,body=None) :
+    """(status,JSON answer) of one request on a kept-alive connection"""
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write((method+" "+path+" HTTP/1.1\r\nHost: "+address.netloc+"\r\nContent-Type: application/json\r\nContent-Length: "+
+                  str(len(data))+"\r\n\r\n").encode("latin-1")+data)
+    await writer.drain()
+    status = (await reader.readline()).decode("latin-1").split()[1]
+    length = 0
+    while True :
+        line = await reader.readline()
+        if line in (b"\r\n",b"\n",b"") :
+            break
+        (name,value) = line.decode("latin-1").split(":",1)
+        if name.strip().lower() == "content-length" :
+            length = int(value)
+    return (status,json.loads(await reader.readexactly(length)))
+
+async def get(reader,writer,path) :
+    """JSON answer of a GET request that has to succeed"""
+    (status,answer) = await call(reader,writer,"GET",path)
+    if status != "200" :
+        raise RuntimeError(status+" "+str(answer))
+    return answer
+
+async def client(pairs,latencies,failures) :
+    (reader,writer) = await asyncio.open_connection(address.hostname,address.port)
+    try :
+        while len(pairs) > 0 :
+            (nid1,nid2) = pairs.pop()
+            start = time.perf_counter()
+            (status,_) = await call(reader,writer,"POST","/route",{ "from" : nid1, "to" : nid2 })
+            if status == "200" :
+                latencies.append(time.perf_counter()-start)
+            else :
+                failures[status] = failures.get(status,0) + 1
+    finally :
+        writer.close()
+
+async def main() :
+    (reader,writer) = await asyncio.open_connection(address.hostname,address.port)
+    nodes = (await get(reader,writer,"/nodes?count=1000"))["nodes"]
+    before = await get(reader,writer,"/stats")
+
+    random.seed(1)
+    starts = random.sample(nodes,sources) if sources > 0 else nodes
+    pairs = [ (random.choice(starts),random.choice(nodes)) for _ in range(requests) ]
+    latencies = []
+    failures = dict()
+    start = time.perf_counter()
+    await asyncio.gather(*[ client(pairs,latencies,failures) for _ in range(concurrency) ])
+    elapsed = time.perf_counter()-start
+
+    after = await get(reader,writer,"/stats")
+    writer.close()
+
+    latencies.sort()
+    percentile = lambda p : latencies[min(len(latencies)-1,int(p/100*len(latencies)))]*1000 if len(latencies) > 0 else math.nan
+    failed = sum(failures.values())
+    log(f"{len(latencies)+failed} requests by {concurrency} clients in {elapsed:.2f}s: {(len(latencies)+failed)/elapsed:.1f} requests/s,",
+        f"p50 {percentile(50):.1f}ms, p99 {percentile(99):.1f}ms of {len(latencies)} routed,",
+        f"{failed} failed" + "".join( f", {count}x {status}" for status,count in sorted(failures.items()) ) + ",",
+        f"{after['searches']-before['searches']} searches for {after['legs']-before['legs']} legs",prio=10)
+
+asyncio.run(main())
@@ -0,0 +1,261 @@
+# Long-running HTTP/JSON routing service on a map loaded once.
+#
+#    python routeservice.py [osmfile] [port] [workers]
+#
+# Nodes are given as OSM node id or as [lat,lon], snapped to the nearest
+# routable node. "rules" is optional, a dict rule -> [lenWeight,pointWeight] as
+# learned by routrainer.py, taken as written. Weights must not be negative.
+# Legs without a route have cost null in a matrix, /route and /multiroute
+# answer 404 for them.
+#
+#    POST /route       {"from": node, "to": node, "rules": {...}}      -> {"cost": c, "nodes": [...]}
+#    POST /multiroute  {"nodes": [node, ...], "rules": {...}}          -> {"cost": c, "nodes": [...]}
+#    POST /matrix      {"sources": [...], "targets": [...], "rules": {...}} -> {"costs": [[...], ...]}
+#    GET  /nodes?count=n   n random routable node ids (n <= 100000), e.g. for loadgen.py
+#    GET  /stats           request, search and route cache counters (of this
+#                          process, the workers keep their own route caches)
+#
+# Searches run in worker processes sharing the graph (workers = 0: in one
+# thread of this process). Legs that start at the same node with the same
+# rules wait together until a worker is free and are then routed by one
+# routeMany() search, so concurrent requests from one source cost a single
+# search, the more so the busier the service is.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import random
+import signal
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from log import log
+from OSMHandler import NegativeWeightsError, OSMHandler
+from RuleEngine import ruleFingerprint
+import training
+from training import resolveNode, rulesToDictTuple, startWorkers
+
+def routeManyWorker(nid1,nids,dictTuple) :
+    return training.workerHandler.routeMany(nid1,nids,dictTuple)
+
+class RequestError(Exception) :
+    """Bad request, answered with status 400"""
+    status = "400 Bad Request"
+
+class NoRoute(RequestError) :
+    status = "404 Not Found"
+
+class RouteService:
+    """Routes legs on an OSMHandler in an executor, legs from the same source coalesced into one search"""
+    # Most node ids a single /nodes request returns
+    maxNodes = 100000
+
+    def __init__(self,osmhandler,workers=0) :
+        self.osmhandler = osmhandler
+        self.workers = workers
+        self.pool = startWorkers(osmhandler,workers) if workers > 0 else ThreadPoolExecutor(1)
+        # (source,rule fingerprint) -> (dictTuple,{ target : [ futures ] }) of legs waiting for a worker
+        self.pending = dict()
+        self.slots = None
+        self.rulesCache = dict()
+        self.stats = { "requests" : 0, "errors" : 0, "legs" : 0, "searches" : 0 }
+
+    def close(self) :
+        self.pool.shutdown()
+        if self.workers > 0 :
+            self.osmhandler.unshare()
+
+    def search(self,nid1,nids,dictTuple) :
+        """concurrent.futures.Future of routeMany() in the pool"""
+        if self.workers > 0 :
+            return self.pool.submit(routeManyWorker,nid1,nids,dictTuple)
+        return self.pool.submit(self.osmhandler.routeMany,nid1,nids,dictTuple)
+
+    def rules(self,rules) :
+        """(dictTuple,fingerprint) of a request's rule dict, the last few are kept"""
+        key = json.dumps(rules,sort_keys=True)
+        if not key in self.rulesCache :
+            if not isinstance(rules,dict) :
+                raise RequestError("rules must be a dict rule -> [lenWeight,pointWeight]")
+            for rule,points in rules.items() :
+                if not all( part[:2] in ("W:","N:") and "==" in part for part in rule.split(" && ") ) :
+                    raise RequestError("rule "+json.dumps(rule)+" is not like \"W:key==value && N:key==value\"")
+                if not isinstance(points,list) or len(points) != 2 or \
+                   not all( isinstance(p,(int,float)) and not isinstance(p,bool) and math.isfinite(p) for p in points ) :
+                    raise RequestError("weights of "+json.dumps(rule)+" must be [lenWeight,pointWeight]")
+                if min(points) < 0 :
+                    raise RequestError("weights of "+json.dumps(rule)+" must not be negative")
+            dictTuple = rulesToDictTuple({ rule : tuple(points) for rule,points in rules.items() })
+            if len(self.rulesCache) >= 16 :
+                self.rulesCache.pop(next(iter(self.rulesCache)))
+            self.rulesCache[key] = (dictTuple,ruleFingerprint(dictTuple))
+        return self.rulesCache[key]
+
+    def node(self,node) :
+        """OSM id of a node given by id or [lat,lon]"""
+        if isinstance(node,list) and len(node) == 2 :
+            node = tuple(node)
+        try :
+            nid = resolveNode(self.osmhandler,node)
+        except (KeyError,TypeError,ValueError) :
+            raise RequestError("no routable node for "+json.dumps(node))
+        if not isinstance(nid,int) or not nid in self.osmhandler.nodes :
+            raise RequestError("unknown node "+json.dumps(node))
+        return nid
+
+    async def leg(self,nid1,nid2,rules) :
+        """(cost,path) from nid1 to nid2, searched together with the other pending legs from nid1
+
+        The path is empty if there is no route.
+        """
+        (dictTuple,fingerprint) = rules
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (nid1,fingerprint)
+        if not key in self.pending :
+            self.pending[key] = (dictTuple,dict())
+            loop.create_task(self.dispatch(key))
+        self.pending[key][1].setdefault(nid2,[]).append(future)
+        self.stats["legs"] += 1
+        return await future
+
+    async def dispatch(self,key) :
+        """Search the pending legs of key once a worker is free"""
+        if self.slots is None :
+            self.slots = asyncio.Semaphore(max(self.workers,1))
+        async with self.slots :
+            (dictTuple,targets) = self.pending.pop(key)
+            nids = list(targets)
+            self.stats["searches"] += 1
+            (results,failure) = (None,None)
+            try :
+                results = await asyncio.wrap_future(self.search(key[0],nids,dictTuple))
+            except Exception as error :
+                failure = error
+        for i,nid2 in enumerate(nids) :
+            for future in targets[nid2] :
+                if future.cancelled() :
+                    continue
+                if failure is not None :
+                    future.set_exception(failure)
+                else :
+                    future.set_result(results[i])
+
+    async def handle(self,path,query,request) :
+        """JSON answer of a request"""
+        if path == "/stats" :
+            return dict(self.stats,routeCache=self.osmhandler.routeCache.stats() if self.osmhandler.routeCache is not None else None)
+        if path == "/nodes" :
+            count = query.get("count",[ "100" ])[0]
+            if not ( count.isascii() and count.isdigit() ) or int(count) > self.maxNodes :
+                raise RequestError("count must be a whole number from 0 to "+str(self.maxNodes))
+            count = int(count)
+            ids = self.osmhandler.graph.nodeIds
+            return { "nodes" : [ int(ids[random.randrange(len(ids))]) for _ in range(count) ] }
+
+        if not isinstance(request,dict) :
+            raise RequestError("expected a JSON object")
+        rules = self.rules(request.get("rules",dict()))
+        if path == "/route" :
+            (nid1,nid2) = (self.node(request.get("from")),self.node(request.get("to")))
+            (cost,found) = await self.leg(nid1,nid2,rules)
+            if len(found) == 0 :
+                raise NoRoute("no route from "+str(nid1)+" to "+str(nid2))
+            return { "cost" : cost, "nodes" : [ nid for (_,nid,_,_) in found ] }
+        if path == "/multiroute" :
+            nids = [ self.node(node) for node in request.get("nodes",[]) ]
+            if len(nids) < 2 :
+                raise RequestError("nodes needs at least two nodes")
+            legs = await asyncio.gather(*[ self.leg(nids[i],nids[i+1],rules) for i in range(len(nids)-1) ])
+            totalPath = []
+            for i,(_,found) in enumerate(legs) :
+                if len(found) == 0 :
+                    raise NoRoute("no route from "+str(nids[i])+" to "+str(nids[i+1]))
+                totalPath += found
+            return { "cost" : sum( cost for (cost,_) in legs ), "nodes" : [ nid for (_,nid,_,_) in totalPath ] }
+        if path == "/matrix" :
+            sources = [ self.node(node) for node in request.get("sources",[]) ]
+            targets = [ self.node(node) for node in request.get("targets",[]) ]
+            costs = await asyncio.gather(*[ self.leg(nid1,nid2,rules) for nid1 in sources for nid2 in targets ])
+            costs = [ cost if len(found) > 0 else None for (cost,found) in costs ]
+            return { "costs" : [ costs[i*len(targets):(i+1)*len(targets)] for i in range(len(sources)) ] }
+        raise RequestError("unknown path "+path)
+
+    async def connection(self,reader,writer) :
+        """Serve the HTTP/1.1 requests of one connection, kept alive unless the client closes it"""
+        try :
+            while True :
+                line = await reader.readline()
+                if not line :
+                    break
+                (method,target,version) = line.decode("latin-1").split()
+                headers = dict()
+                while True :
+                    line = await reader.readline()
+                    if line in (b"\r\n",b"\n",b"") :
+                        break
+                    (name,value) = line.decode("latin-1").split(":",1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length","0")))
+
+                self.stats["requests"] += 1
+                url = urlsplit(target)
+                try :
+                    request = json.loads(body) if len(body) > 0 else None
+                    answer = await self.handle(url.path,parse_qs(url.query),request)
+                    status = "200 OK"
+                except RequestError as e :
+                    answer = { "error" : str(e) }
+                    status = e.status
+                    self.stats["errors"] += 1
+                except (NegativeWeightsError,json.JSONDecodeError) as e :
+                    answer = { "error" : str(e) }
+                    status = "400 Bad Request"
+                    self.stats["errors"] += 1
+                except Exception as e :
+                    log("Request failed:",method,target,repr(e),prio=10)
+                    answer = { "error" : repr(e) }
+                    status = "500 Internal Server Error"
+                    self.stats["errors"] += 1
+
+                data = json.dumps(answer).encode("utf-8")
+                close = headers.get("connection","").lower() == "close" or version == "HTTP/1.0"
+                writer.write(("HTTP/1.1 "+status+"\r\nContent-Type: application/json\r\nContent-Length: "+str(len(data))+
+                              "\r\n"+( "Connection: close\r\n" if close else "" )+"\r\n").encode("latin-1")+data)
+                await writer.drain()
+                if close :
+                    break
+        except (asyncio.IncompleteReadError,ConnectionError,ValueError) :
+            pass
+        finally :
+            writer.close()
+
+async def serve(service,port) :
+    """Serve until SIGINT or SIGTERM"""
+    server = await asyncio.start_server(service.connection,"127.0.0.1",port)
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT,signal.SIGTERM) :
+        asyncio.get_running_loop().add_signal_handler(signum,stopped.set)
+    log("Routing service on http://127.0.0.1:"+str(port),prio=10)
+    async with server :
+        await stopped.wait()
+    log("Routing service stopped after",service.stats["requests"],"requests",prio=10)
+
+if __name__ == "__main__" :
+    osmfile = sys.argv[1] if len(sys.argv) > 1 else "mannheim-dbhw.osm"
+    port    = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    start = time.time()
+    osmhandler = OSMHandler(True,True,True,True)
+    osmhandler.apply_file(osmfile)
+    osmhandler.prepareLandmarks(16)
+    log("Map ready in",f"{time.time()-start:.2f}s",prio=10)
+
+    service = RouteService(osmhandler,workers)
+    try :
+        asyncio.run(serve(service,port))
+    finally :
+        service.close()
@@ -0,0 +1,478 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import os
+from typing import Dict, Tuple
+
+from log import log
+from OSMHandler import OSMHandler
+
+def tagOrder(tag) :
+    """Sort key of "W:"/"N:" tags in canonical rules: way tags first, then by tag"""
+    return (tag[0] != "W",tag)
+
+def canonicalRule(rule) :
+    """Rule with its tags in canonical order, see tagOrder()
+
+    rulesToDictTuple() nests a rule under its first tag and addRule() adds the
+    rule without its last tag as parent, so canonical rules only get canonical
+    parents.
+    """
+    return " && ".join(sorted(rule.split(" && "),key=tagOrder))
+
+def rulesToDictTuple(rules,result = None):
+    """Generate fast dict structure for list of rules as strings"""
+    if result == None : 
+        result = (dict(),dict())
+    for rule,score in rules.items() :
+        
+        parts = rule.split(" && ",1)
+        part1 = parts[0]
+        kind  = part1.split(":",1)
+        kind1 = kind[0]
+        
+        if kind1 == 'N' : 
+            t = 0
+        else :
+            t = 1  
+
+        rule = kind[1]        
+        if len(parts)==1 :
+            if rule in result[t] :
+                (_,olddict) = result[t][rule]
+                result[t][rule] = (score,olddict)
+                
+            else :
+                result[t][rule] = (score,(dict(),dict()))
+                
+        else :
+            if rule in result[t] :
+                (oldscore,olddicttuple) = result[t][rule]
+                newdicttuple = rulesToDictTuple({parts[1]:score},olddicttuple)
+                result[t][rule] = (oldscore,newdicttuple)
+                
+            else :
+                result[t][rule] = ((0,0),rulesToDictTuple({parts[1]:score}))
+                
+    return result
+
+# Disregard these tags at all.
+killTags = { "source", "source:geometry", "source:maxspeed", "name", "note", "area", "wikidata", "layer", "railway:pos", 
+             "wikipedia", "ref", "old_old_name", "old_name", "ref:RNV:RBL" , "start_date", "created_by", "railway:signal:speed_limit",
+             "end_date", "workrules", "operator", "destination", "admin_level" , "railway:position" , "railway:position:exact" ,
+             "railway:signal:crossing:states", "ele" , "railway:signal:position", "lcn_ref" }
+
+def usedTagsFromPath(osmhandler,path,dictTupleRules=(dict(),dict())) -> Dict[ str , Tuple[ float , float ] ] :
+    """Deduce all rules used for this path as dict with length for ways and count for node rules"""
+    allTags = dict()
+
+    lastnid = path[0][1]
+    compiled = osmhandler.compileRules(dictTupleRules) if osmhandler.graph is not None else None
+
+    for wid,nid,_,length in path :
+        used = osmhandler.stepRules(dictTupleRules,lastnid,nid,wid,compiled)
+        lastnid = nid
+        for rule in used :
+            (oldlength,oldcount) = (0,0)
+            if rule in allTags :
+                (oldlength,oldcount) = allTags[rule]
+            if rule.count("W:") > 0 :
+                if rule.count("N:") > 0 : 
+                    allTags[rule] = (oldlength+length,oldcount+1)
+                else :
+                    allTags[rule] = (oldlength+length,oldcount)
+            else :
+                allTags[rule] = (oldlength,oldcount+1)
+        
+    return allTags
+
+def combinations(src,depths,combine=" && ",prefix="") :
+    """Compute all rule combinations for given simple rules up to a given depth
+
+    Combinations of up to depths+1 rules keep the order of src and are listed
+    depth first, as in the old recursive version.
+    """
+    indices = [ c for size in range(1,max(depths,0)+2) for c in itertools.combinations(range(len(src)),size) ]
+    return [ prefix + combine.join( src[i] for i in c ) for c in sorted(indices) ]
+
+def tagsFromPath(osmhandler,path,depth = 1) -> Dict[ str , Tuple[ float , float ] ] :
+    """Deduce all possible rules that could be used on a given path up to a given depth
+
+    Rules are the canonical (see canonicalRule()) combinations of up to depth+1
+    of the way tags and the tags of both nodes of a step, with the summed length
+    of the steps for rules with way tags and the number of steps for rules with
+    node tags. Steps with the same tags (the same interned tag signatures in
+    compact mode) are counted together and their combinations enumerated once.
+    """
+    graph = osmhandler.graph
+    if graph is not None :
+        sigStrings = graph.sigStrings()
+        wayKey  = lambda wid : int(graph.waySig[graph.wayIndex(wid)])
+        nodeKey = lambda nid : int(graph.nodeSig[graph.index(nid)])
+        tagItems = lambda sig : ( item.split("==",1) for item in sigStrings[sig] )
+    else :
+        wayKey  = lambda wid : tuple(osmhandler.ways[wid].tags.items())
+        nodeKey = lambda nid : tuple(osmhandler.nodes[nid].tags.items())
+        tagItems = lambda items : items
+
+    stepCounts  = Counter()
+    stepLengths = Counter()
+    lastKey = None
+    for wid,nid,_,length in path :
+        # if length>0 : maybe exclude the first step
+        key = nodeKey(nid)
+        step = (wayKey(wid),key,lastKey)
+        lastKey = key
+        stepCounts[step]  += 1
+        stepLengths[step] += length
+
+    tagCache = dict()
+    def canonicalTags(kind,key) :
+        """Sorted "W:"/"N:" tags of a way or node key, without killTags"""
+        if not (kind,key) in tagCache :
+            tagCache[kind,key] = sorted( kind+tag+"=="+value for tag,value in tagItems(key) if not tag in killTags )
+        return tagCache[kind,key]
+
+    allTags = dict()
+    for (way,node,lastNode),count in stepCounts.items() :
+        length = stepLengths[way,node,lastNode]
+        nodeTags = set(canonicalTags("N:",node))
+        if lastNode is not None :
+            nodeTags |= set(canonicalTags("N:",lastNode))
+        tags = canonicalTags("W:",way) + sorted(nodeTags)
+
+        for size in range(1,min(depth+1,len(tags))+1) :
+            for combination in itertools.combinations(tags,size) :
+                # Way tags come first, so a rule has way tags if it starts with
+                # one and node tags if it ends with one
+                rule = " && ".join(combination)
+                (l,c) = allTags.get(rule,(0,0))
+                allTags[rule] = ( l+length if combination[0][0] == "W" else 0,
+                                  c+count  if combination[-1][0] == "N" else 0 )
+
+    return allTags
+
+def addRule(currentRules,rule,points,reason) :
+    """Helper function to add a new rule to a rule list, adding also null parent rules if needed"""
+    rule = canonicalRule(rule)
+    log("Adding rule",rule,points,reason,prio=6)
+    currentRules[rule]=points
+    parts = rule.rsplit(" && ",1)
+    if len(parts)>1 and not parts[0] in currentRules :
+        addRule(currentRules,parts[0],(0,0),"")
+
+def saveCheckpoint(filename,state) :
+    """Write a training state dict with "rules" as JSON, atomically replacing filename"""
+    state = dict(state,rules=[ [ rule, list(points) ] for rule,points in state["rules"].items() ])
+    tmpname = filename + ".tmp"
+    with open(tmpname,"w") as f :
+        json.dump(state,f,separators=(",",":"))
+    os.replace(tmpname,filename)
+
+def loadCheckpoint(filename) :
+    """Training state written by saveCheckpoint(), None if there is none"""
+    if not os.path.exists(filename) :
+        return None
+    with open(filename) as f :
+        state = json.load(f)
+    state["rules"] = { rule : tuple(points) for rule,points in state["rules"] }
+    return state
+
+def loadRules(filename) :
+    """Rules of a checkpoint or of a JSON file with a dict rule -> [lenWeight,pointWeight]
+
+    Rules are kept as written: rulesToDictTuple() nests a rule under its first
+    tag, so putting the tags in canonical order could change which rule
+    overrides which.
+    """
+    with open(filename) as f :
+        rules = json.load(f)
+    if isinstance(rules,dict) and "rules" in rules :
+        rules = rules["rules"]
+    if isinstance(rules,dict) :
+        rules = rules.items()
+    return { rule : tuple(points) for rule,points in rules }
+
+def tagDifference(fromTags,toTags) :
+    """toTags - fromTags per rule for dicts rule -> (length,count), without (0,0) entries"""
+    difference = dict()
+    for key in fromTags.keys() | toTags.keys() :
+        if key in toTags :
+            plus = toTags[key]
+            if key in fromTags :
+                minus = fromTags[key]
+                value = (plus[0]-minus[0],plus[1]-minus[1])
+            else :
+                value = plus
+        else :
+            minus = fromTags[key]
+            value = (-minus[0],-minus[1])
+        if value!=(0,0) :
+            difference[key] = value
+    return difference
+
+def addDifferenceRules(currentRules,differenceTags,error) :
+    """Add the rules among differenceTags that best explain an error not compensated by the existing rules
+
+    differenceTags are tagDifference() entries not yet in currentRules. Returns
+    whether a rule was added.
+    """
+    if len(differenceTags) == 0 :
+        log("There are no tags to add. Lost compensation:",error)
+        return False
+
+    differenceTagsLengthSorted = sorted(differenceTags.items(), key = lambda v : v[1][0] * ( 1 - v[0].count("&&") / 100.0 ) if v[0].count("W:")>0 else 0 )
+    differenceTagsNodeSorted = sorted(differenceTags.items(), key = lambda v : v[1][1] * ( 1 - v[0].count("&&") / 100.0 ) if v[0].count("N:")>0 else 0 )
+
+    wayRule = differenceTagsLengthSorted[0]
+    if len(differenceTagsLengthSorted)>2 :
+        log("Way diff: ",differenceTagsLengthSorted[0],differenceTagsLengthSorted[1],differenceTagsLengthSorted[2])
+
+    nodeRule = differenceTagsNodeSorted[0]
+    if len(differenceTagsNodeSorted)>2 :
+        log("Node diff: ",differenceTagsNodeSorted[0],differenceTagsNodeSorted[1],differenceTagsNodeSorted[2])
+
+    added = False
+    if nodeRule != wayRule :
+        if wayRule[1][0] < 0 :
+            addRule(currentRules,wayRule[0],( -(error / 2) / wayRule[1][0] , 0 ),"because "+str(wayRule[1]))
+            added = True
+        if nodeRule[1][1] < 0 :
+            addRule(currentRules,nodeRule[0],(0,-(error / 2) / nodeRule[1][1] ),"because "+str(nodeRule[1]))
+            added = True
+    else :
+        if  wayRule[1][0] < 0 and wayRule[1][1] < 0 :
+            addRule(currentRules,wayRule[0],( -(error / 2) / wayRule[1][0] , -(error / 2) / wayRule[1][1] ),"because "+str(wayRule[1]))
+            added = True
+        elif wayRule[1][0] < 0 :
+            addRule(currentRules,wayRule[0],( -error / wayRule[1][0] , 0 ),"because "+str(wayRule[1]))
+            added = True
+        elif wayRule[1][1] < 0 :
+            addRule(currentRules,wayRule[0],( 0 , -error / wayRule[1][1] ),"because "+str(wayRule[1]))
+            added = True
+    return added
+
+def addOverridingRule(currentRules,differenceTags) :
+    """Add the most specific way rule the learned path uses most more than the other one, with no penalty
+
+    In override mode it replaces the penalty of a more general rule on these
+    ways, so the solver can make the learned path cheaper where no rule can
+    make the other path more expensive. Returns whether a rule was added.
+    """
+    candidates = [ (value[0],rule.count(" && "),rule) for rule,value in differenceTags.items() if value[0] > 0 and rule.count("N:") == 0 ]
+    if len(candidates) == 0 :
+        return False
+    (length,_,rule) = max(candidates)
+    addRule(currentRules,rule,(0,0),"to override, because "+str(length))
+    return True
+
+def resolveNode(osmhandler,node) :
+    """Node id for a node given by id or as (lat,lon), snapped to the nearest routable node"""
+    if isinstance(node,tuple) :
+        return osmhandler.nearestNode(*node)
+    return node
+
+def resolveCase(osmhandler,case) :
+    """Training case with all nodes given by id, see resolveNode()"""
+    return (resolveNode(osmhandler,case[0]),
+            resolveNode(osmhandler,case[1]),
+            [ resolveNode(osmhandler,node) for node in case[2] ],
+            case[3])
+
+def caseInMap(osmhandler,case) :
+    """Whether all nodes of a training case are in the loaded map"""
+    for node in [ case[0] ] + case[2] + [ case[1] ] :
+        if not node in osmhandler.nodes :
+            return False
+    return True
+
+def evaluateCase(osmhandler,case,dictTuple,depth=3) :
+    """Route a training case and, if it fails, collect the tag statistics of both paths
+
+    Returns (directCost,directPath,learnCost,learnPath,tags,region) with tags as
+    (directTags,learnTags,directUsedTags,learnUsedTags) or None for a passed case,
+    and region the tags of all edges the searches looked at (see OSMHandler.regionTags).
+    """
+    return evaluateGroup(osmhandler,[ case ],dictTuple,depth)[0]
+
+def evaluateGroup(osmhandler,cases,dictTuple,depth=3) :
+    """evaluateCase() for cases routed together, legs from the same node share one search
+
+    All cases get the region of the whole group.
+    """
+    routes = []
+    for case in cases :
+        routes += [ case[0:2], [ case[0] ] + case[2] + [ case[1] ] ]
+
+    osmhandler.startRegion()
+    found = osmhandler.multiRoutes(routes,dictTuple)
+    region = osmhandler.regionTags()
+
+    results = []
+    for i in range(len(cases)) :
+        ((directCost,directPath),(learnCost,learnPath)) = found[2*i:2*i+2]
+
+        tags = None
+        relativeError = ( learnCost - directCost ) / ( directCost + 1e-4 ) * 100
+        if relativeError >= 1e-8 :
+            tags = ( tagsFromPath(osmhandler,directPath,depth),
+                     tagsFromPath(osmhandler,learnPath,depth),
+                     usedTagsFromPath(osmhandler,directPath,dictTuple),
+                     usedTagsFromPath(osmhandler,learnPath,dictTuple) )
+
+        results.append((directCost,directPath,learnCost,learnPath,tags,region))
+    return results
+
+def changedRules(oldRules,newRules) :
+    """Rules added, removed or changed between two rule dicts"""
+    changed = { rule for rule,score in newRules.items() if oldRules.get(rule) != score }
+    return changed | ( oldRules.keys() - newRules.keys() )
+
+def dependsOn(region,rules) :
+    """Whether any rule could match an edge of a search region, i.e. all its tags occur there"""
+    for rule in rules :
+        if all( part in region for part in rule.split(" && ") ) :
+            return True
+    return False
+
+class CaseResults:
+    """Last evaluateCase() result of each case with the rules it was computed with
+
+    A case only needs to be routed again if a rule changed since then that can
+    match one of the edges its searches looked at. Other edges cannot change the
+    found costs since the heuristic stays a lower bound for all non-negative rules.
+    """
+    def __init__(self) :
+        self.results = dict()
+        self.evaluated = 0
+
+    def stale(self,i,currentRules) :
+        if not i in self.results :
+            return True
+        (result,rules) = self.results[i]
+        return dependsOn(result[5],changedRules(rules,currentRules))
+
+    def get(self,i) :
+        return self.results[i][0]
+
+    def store(self,i,result,currentRules) :
+        self.results[i] = (result,dict(currentRules))
+        self.evaluated += 1
+
+def solveConstraints(osmhandler,constraints,ruleWeights,currentRules) :
+    """Solve all constraints for the rule weights, see RuleWeights.solve()
+
+    Stores the weights into currentRules and returns (worst violation per
+    case,number of changed rules), or (None,0) with currentRules unchanged if
+    the constraints could not be solved.
+    """
+    rows = constraints.constraints(osmhandler,currentRules,rulesToDictTuple(currentRules))
+    ruleWeights.sync(currentRules)
+    violations = ruleWeights.solve([ ruleWeights.features(difference) for (_,difference,_) in rows ],
+                                   [ offset for (_,_,offset) in rows ],
+                                   [ i for (i,_,_) in rows ])
+    if violations is None :
+        log("Could not solve",len(rows),"constraints for",len(currentRules),"rules",prio=8)
+        return (None,0)
+    changed = ruleWeights.store(currentRules)
+    worst = dict()
+    for (i,_,_),violation in zip(rows,violations.tolist()) :
+        worst[i] = max(worst.get(i,0),violation)
+    log("Solved",len(rows),"constraints for",len(currentRules),"rules, remaining error",sum(worst.values()),prio=8)
+    return (worst,changed)
+
+class PathConstraints:
+    """Alternative paths found for the cases, the learned path must not cost more than any of them
+
+    For rule weights w the cost of a path is its length plus the used tags of
+    the path (see usedTagsFromPath()) times w. So learnCost - directCost is
+    features . w + offset with the used tag difference of the two paths as
+    features and their length difference as offset. Which rules a path uses
+    depends on which rules exist, not on their weights, so features are
+    computed again only after rules were added.
+    """
+    def __init__(self) :
+        self.learnPaths = dict()
+        self.alternatives = dict()
+        self.usedTags = dict()
+        self.usedTagsRules = set()
+
+    def add(self,i,learnPath,directPath) :
+        """Record the current learned path of case i and a path found instead"""
+        self.learnPaths[i] = learnPath
+        self.alternatives.setdefault(i,dict())[tuple( nid for (_,nid,_,_) in directPath )] = directPath
+
+    def learned(self,i,learnPath) :
+        """Update the learned path of case i, e.g. after it passed"""
+        if i in self.learnPaths :
+            self.learnPaths[i] = learnPath
+
+    def state(self) :
+        """Learned and alternative paths as JSON lists for checkpoints, see restore()"""
+        return { "learnPaths" : [ [ i, learnPath ] for i,learnPath in self.learnPaths.items() ],
+                 "alternatives" : [ [ i, list(paths.values()) ] for i,paths in self.alternatives.items() ] }
+
+    def restore(self,state) :
+        for i,learnPath in state["learnPaths"] :
+            self.learnPaths[i] = [ tuple(step) for step in learnPath ]
+        for i,paths in state["alternatives"] :
+            for directPath in paths :
+                self.add(i,self.learnPaths[i],[ tuple(step) for step in directPath ])
+
+    def pathTags(self,osmhandler,path,dictTuple) :
+        key = tuple( nid for (_,nid,_,_) in path )
+        if not key in self.usedTags :
+            self.usedTags[key] = usedTagsFromPath(osmhandler,path,dictTuple)
+        return self.usedTags[key]
+
+    def constraints(self,osmhandler,currentRules,dictTuple) :
+        """[ (case,usedTags difference,length difference) ] for all alternative paths of all cases"""
+        if self.usedTagsRules != currentRules.keys() :
+            self.usedTags = dict()
+            self.usedTagsRules = set(currentRules.keys())
+        result = []
+        for i,learnPath in self.learnPaths.items() :
+            learnTags = self.pathTags(osmhandler,learnPath,dictTuple)
+            learnLength = sum( length for (_,_,_,length) in learnPath )
+            for directPath in self.alternatives[i].values() :
+                directTags = self.pathTags(osmhandler,directPath,dictTuple)
+                directLength = sum( length for (_,_,_,length) in directPath )
+                result.append((i,tagDifference(directTags,learnTags),learnLength-directLength))
+        return result
+
+# Handler of a worker process, attached to the shared graph of the trainer
+workerHandler = None
+
+def attachWorker(handle) :
+    global workerHandler
+    workerHandler = OSMHandler.attach(handle)
+
+def evaluateWorker(cases,dictTuple) :
+    return evaluateGroup(workerHandler,cases,dictTuple)
+
+def startWorkers(osmhandler,workers) :
+    """Process pool whose workers route on the shared graph of osmhandler"""
+    return ProcessPoolExecutor(workers,initializer=attachWorker,initargs=(osmhandler.share(),))
+
+def evaluateCases(osmhandler,cases,dictTuple,pool=None) :
+    """evaluateCase() for all cases against one rule snapshot, results in case order
+
+    Cases with the same start node are evaluated as one group, see evaluateGroup().
+    """
+    groups = dict()
+    for i,case in enumerate(cases) :
+        groups.setdefault(case[0],[]).append(i)
+    groups = list(groups.values())
+    groupCases = [ [ cases[i] for i in group ] for group in groups ]
+
+    if pool is None :
+        groupResults = [ evaluateGroup(osmhandler,group,dictTuple) for group in groupCases ]
+    else :
+        groupResults = pool.map(evaluateWorker,groupCases,[ dictTuple ] * len(groupCases))
+
+    results = [ None ] * len(cases)
+    for group,groupResult in zip(groups,groupResults) :
+        for i,result in zip(group,groupResult) :
+            results[i] = result
+    return results
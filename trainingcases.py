@@ -0,0 +1,63 @@
+training=[]
+
+# Some training rules for pedestrian routing
+# Each node contains start-node-id, end-node-id, vector of node-ids the correct route should hit and a description of the rule
+# Nodes can also be given as (lat,lon), they are snapped to the nearest routable node (compact mode only), e.g.
+# training+=[((49.4750,8.5350),(49.4790,8.5420),[(49.4771,8.5388)], "Example with coordinates")]
+training+=[(322724138 ,1453882690,[1453886768],           "Unterführung Seckenheimer Landstraße")]
+training+=[(1756299817,502884638 ,[502884643, 1756563796],"Ampeln und Kreisel Seckenheimer Landstraße")]
+training+=[(413010379 ,310400601 ,[535605593],            "Fußweg")]
+training+=[(1881726485,142350530 ,[527915767],            "Fußweg statt Gleise oder Straße")]
+training+=[(1468332673,1113318377,[1113317863],           "Unterführung" )]
+training+=[(2121135484,3842351078, [3842351076],            "Ampeln Dudenstraße Käfertaler Straße")]
+training+=[(1677760912,1612259391, [3842501028,1834049546],"Käfertaler Straße Nord")]
+training+=[(1677760912,3682702873, [3307348383],           "Käfertaler Straße Süd")]
+training+=[(1173745024,3542320641, [1173732262,299217480], "Unterquerung Feudenheimer Straße")]
+training+=[(1098478180,1732901428, [1379282824,1732901432,1002344349,2572058787], "Fuß- und Radweg nutzen")]
+training+=[(1448650716,1844687205, [1448650682,1448650693,1362784561,1183431355], "Fuß- und Radweg nutzen 2")]
+
+'''
+training+=[(1375039791,1455541494, [1455549916,1455555433,1455541503], "Neustadter Straße West")]
+training+=[(322724138,406254680 ,  [322724145,322724999,322725087,956123294,322725090,603138574,603138613,603138704,60312496,406253882], "Seckenheimer Landstraße")]
+training+=[(249805903,310205463, [251718412],            "Ruhige Straßen sind besser")]
+training+=[(1317464103,2379698798,[1197278190,603237135,673789943], "Von Plattform zu Plattform")]
+training+=[(266757865,266756532,  [1454283206,1759419579],"Brücken richtig gehen")]
+training+=[(1434504625,2542264822,[1434504109],           "Gatter meiden")]
+training+=[(2103526714,1434504539,[2103526666],           "Gatter meiden 2")]
+training+=[(1756710506,2429466372,[393849218],            "Wege statt Straßen")]
+training+=[(1098478174,1355500437, [1165361256,1422722333],         "Ampel nutzen")]
+training+=[(603140003,1098478174, [1791262636],           "Autobahnbrücke richtig nutzen")]
+training+=[(1098478180,6069448777, [1362784564],         "Feldweg nutzen, wenn gut")]
+training+=[(1860572349,1825708545 ,[1986235290,1986235278,1732872569], "Lauffener Straße")]
+training+=[(1422722333,1422743236, [1422722322,1422722338,1422722336], "Ampel über Siebenbürger Straße")]
+training+=[(1098478174,1165361290, [1165361330,1165361256], "Ampel über Banater Straße")]
+training+=[(249805898,310399252,   [249805900],            "Hauptstraße an Ampel queren")]
+training+=[(4437962975,304729644,  [1363816431,1358213268,1358213265], "Fußweg an Pommernstraße")]
+training+=[(6556111157,304942679,  [1375188617,2793536573,1375188621], "Überkreuzung Wingertsbuckel")]
+training+=[(1178604860,1178604881, [1359858733,1359858737,1178604826,1178604872,1178604855], "Wingertsbuckel entlang")]
+training+=[(1375309349,2612335766, [1375306583,1375309366], "Überquerung Klingenberger Straße")]
+training+=[(1113318243,304942682,  [1113318338,1362784571,1362784574,1375177620,1375179557], "Überquerung Aubuckel")]
+training+=[(1183456771,290518526,  [1183456548,1183456456], "Entlang Wallstadter Straße")]
+training+=[(1355500435,1025583268, [1355500447,1355500445,1355500439], "Überkreuzung Ilvesheimer Straße")]
+training+=[(1113318243,1178604845, [1362784571],            "Überkreuzung Aubuckel Wingertsbuckel")]
+training+=[(2121121480,2121135484, [2121135497,2121135479,2121135504,2121135472,2578451911,2121143103,2121135491], "Entlang Dudenstraße")]
+training+=[(253877953,1472399057,  [1874987211,766746541,1165181988], "Entlang Weinheimer Straße")]
+training+=[(1836601732,1296616860, [300891440],            "Luisenpark Wege")]
+training+=[(3439682575,268325207,  [273179548],            "Luisenpark Wege 2")]
+training+=[(2594574429,268325195,  [1836601614],           "Luisenpark Eingang")]
+training+=[(1270403687,1270706639, [1744716500],           "Bushaltestelle Pfeifferswörth - Feudenheimer Straße")]
+training+=[(474658341,1247437361,  [1751118421],          "Überquerung Ludwig-Ratzel-Straße")]
+#training+=[(1751118421,2136553689, [2594575002],          "Entlang Luisenpark")]
+training+=[(411758474,1751600352, [1751558496,1751600341],"Seckenheimer Landstraße / Dürerstraße")]
+training+=[(766746544,280267372,   [1360957710,304944550,1589652383], "Koblenzer Straße / Im Rott")]
+training+=[(30561280,1434504103,   [30561279],             "Keine Parkplatztouren in der Au")]
+training+=[(75961572,1338448176,   [144213072],            "Tauberbishofsheimer Straße")]
+training+=[(1430383985,1165361104, [297597831],            "Umgehung Banater Straße")]
+training+=[(378372649,1831969010,  [266924543,1305153463], "Umgehung Neuostheimer Straße")]
+training+=[(3320376846,2434547065, [2434533613,2434547068], "Überkreuzung Friedrichsring")]
+training+=[(249805910,1486120496,  [475365845],            "Hauptstraße Zugang Bahnsteig")]
+training+=[(77862756,1435446288,   [1435446284,1435446293],"Osterburker Straße Ost")]
+training+=[(77862756,1518152602,   [1169045009,1518152595],"Osterburker Straße West")]
+
+#training+=[(840917640,2235009413,[1453886768,1435317906,502884628,266186964,502884623,266191035,30561286,893087192] , "Coblitzallee nach Käfertal nach Google Pedestrian") ]
+'''